@@ -2,20 +2,412 @@
 
 import subprocess
 import json
+import math
 import time
 import argparse
+import asyncio
+import atexit
+import base64
+import contextlib
+import csv
+import glob
+import hashlib
+import heapq
+import io
 import sys
 import platform
 import os
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime
+import queue
+import shutil
+import socket
+import socketserver
+import sqlite3
+import tempfile
+import threading
+from typing import List, Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit, urlunsplit
 import random
+import re
+import signal
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 SYSTEM = platform.system()
 IS_WINDOWS = SYSTEM == 'Windows'
 IS_MACOS = SYSTEM == 'Darwin'
 IS_LINUX = SYSTEM == 'Linux'
 
+TRAFFIC_PROBE = ('am.i.mullvad.net', 443)
+
+RELAY_CACHE_VERSION = 3
+CAPABILITY_CACHE_VERSION = 1
+DEFAULT_CACHE_TTL = 6 * 3600
+SCREEN_PORT = 443
+LIVENESS_ATTEMPTS = 3
+SAMPLE_CV_LIMIT = 0.15
+JOURNAL_VERSION = 1
+DEFAULT_RESUME_WINDOW = 60
+HISTORY_DAYS = 30
+TRACE_CAPACITY = 200000
+CLIENT_CPU_LIMIT = 90.0
+ECHO_RATE = 20.0
+ECHO_TIMEOUT = 1.0
+ECHO_IDLE_SECONDS = 1.0
+ECHO_PORT = 7
+COMPARE_ALPHA = 0.05
+MWU_EXACT_LIMIT = 20
+CLIFF_MAGNITUDES = ((0.474, 'large'), (0.33, 'medium'), (0.147, 'small'))
+EARTH_RADIUS_KM = 6371.0088
+
+REGIONS = {
+    'europe': ['Albania', 'Austria', 'Belgium', 'Bulgaria', 'Croatia', 'Cyprus', 'Czech Republic', 'Denmark',
+               'Estonia', 'Finland', 'France', 'Germany', 'Greece', 'Hungary', 'Ireland', 'Italy', 'Latvia',
+               'Luxembourg', 'Netherlands', 'Norway', 'Poland', 'Portugal', 'Romania', 'Serbia', 'Slovakia',
+               'Slovenia', 'Spain', 'Sweden', 'Switzerland', 'UK', 'Ukraine'],
+    'north-america': ['Canada', 'Mexico', 'USA'],
+    'south-america': ['Argentina', 'Brazil', 'Chile', 'Colombia', 'Peru'],
+    'asia': ['Hong Kong', 'Indonesia', 'Israel', 'Japan', 'Malaysia', 'Philippines', 'Singapore', 'Thailand',
+             'Turkey', 'UAE'],
+    'oceania': ['Australia', 'New Zealand'],
+    'africa': ['Nigeria', 'South Africa'],
+}
+
+MULLVAD_SETTINGS_DIR = '/etc/mullvad-vpn'
+if IS_WINDOWS:
+    MULLVAD_CACHE_DIR = os.path.join(os.environ.get('PROGRAMDATA', 'C:\\ProgramData'), 'Mullvad VPN', 'cache')
+elif IS_MACOS:
+    MULLVAD_CACHE_DIR = '/Library/Caches/mullvad-vpn'
+else:
+    MULLVAD_CACHE_DIR = '/var/cache/mullvad-vpn'
+WIREGUARD_PORT = 51820
+MULLVAD_DNS = '10.64.0.1'
+
+def get_cache_dir() -> str:
+    if os.environ.get('TBI_SPEED_CACHE_DIR'):
+        return os.environ['TBI_SPEED_CACHE_DIR']
+    if IS_WINDOWS:
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+    elif IS_MACOS:
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'tbi_speed')
+
+def write_json_atomic(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def probe_tool(name: str, version_args: List[str]) -> Optional[str]:
+    path = shutil.which(name)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    
+    key = f"{os.path.realpath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    cache_path = os.path.join(get_cache_dir(), 'capabilities.json')
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if cache.get('version') != CAPABILITY_CACHE_VERSION:
+        cache = {'version': CAPABILITY_CACHE_VERSION, 'tools': {}}
+    entry = cache['tools'].get(name)
+    if entry and entry.get('key') == key:
+        return entry['version']
+    
+    try:
+        completed = subprocess.run([path] + version_args, capture_output=True, text=True, check=True,
+                                   timeout=PHASE_TIMEOUTS['command'])
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return None
+    lines = completed.stdout.strip().splitlines()
+    cache['tools'][name] = {'key': key, 'version': lines[0] if lines else ''}
+    try:
+        write_json_atomic(cache_path, cache)
+    except OSError:
+        pass
+    return cache['tools'][name]['version']
+
+class ResultJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def start(self, plan: List[Dict], results: List[Dict] = ()):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        records = [{'type': 'plan', 'version': JOURNAL_VERSION, 'started_at': time.time(),
+                    'relays': [relay.to_dict() if isinstance(relay, Relay) else dict(relay) for relay in plan]}]
+        records.extend({'type': 'result', 'result': result} for result in results)
+        
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+    
+    def append(self, result: Dict):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps({'type': 'result', 'result': result}) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    @staticmethod
+    def load(path: str) -> Tuple[Optional[List['Relay']], List[Dict]]:
+        plan = None
+        results = []
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('type') == 'plan' and record.get('version') == JOURNAL_VERSION:
+                        plan = [Relay.from_dict(relay) for relay in record['relays']]
+                        results = []
+                    elif record.get('type') == 'result' and plan is not None:
+                        results.append(record['result'])
+        except OSError:
+            pass
+        return plan, results
+
+class ResultStream:
+    CSV_FIELDS = ['timestamp', 'server', 'country', 'city', 'provider', 'download', 'upload', 'ping',
+                  'connect_time', 'screen_rtt', 'n', 'idle_ping', 'loaded_ping', 'loaded_ping_p99', 'jitter', 'loss']
+    
+    def __init__(self, fmt: str, path: str = '-', output=None):
+        self.format = fmt
+        self.path = path
+        self._lock = threading.Lock()
+        if path == '-':
+            self._file = output or sys.stdout
+            fresh = True
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'a', newline='')
+            fresh = self._file.tell() == 0
+        self._writer = None
+        if fmt == 'csv':
+            fields = self.CSV_FIELDS
+            if not fresh:
+                with open(path, newline='') as existing:
+                    fields = next(csv.reader(existing), None) or fields
+            self._writer = csv.DictWriter(self._file, fields, extrasaction='ignore', lineterminator='\n')
+            if fresh:
+                self._writer.writeheader()
+                self._file.flush()
+    
+    def emit(self, result: Dict):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                if self._writer:
+                    row = dict(result, n=len(result['samples']['download']) if result.get('samples') else 1)
+                    self._writer.writerow(row)
+                else:
+                    self._file.write(json.dumps(result) + '\n')
+                self._file.flush()
+            except BrokenPipeError:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, self._file.fileno())
+                os.close(devnull)
+                self._file = None
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None and self.path != '-':
+                self._file.close()
+            self._file = None
+
+class HistoryStore:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INTEGER PRIMARY KEY,
+            server TEXT NOT NULL,
+            country TEXT NOT NULL,
+            city TEXT NOT NULL,
+            protocol TEXT NOT NULL,
+            download REAL NOT NULL,
+            upload REAL NOT NULL,
+            ping REAL NOT NULL,
+            connect_time REAL,
+            measured_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS measurements_server ON measurements (server, measured_at);
+        CREATE INDEX IF NOT EXISTS measurements_city ON measurements (city, measured_at);
+        CREATE INDEX IF NOT EXISTS measurements_protocol ON measurements (protocol, measured_at);
+        CREATE INDEX IF NOT EXISTS measurements_time ON measurements (measured_at);
+    '''
+    
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+    
+    def record(self, result: Dict):
+        measured_at = datetime.fromisoformat(result['timestamp']).timestamp()
+        samples = result.get('samples') or {key: [result[key]] for key in ('download', 'upload', 'ping')}
+        rows = [(result['server'], result['country'], result['city'], result['provider'].lower(),
+                 download, upload, ping, result.get('connect_time'), measured_at)
+                for download, upload, ping in zip(samples['download'], samples['upload'], samples['ping'])]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO measurements (server, country, city, protocol, download, upload, ping, '
+                'connect_time, measured_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    
+    def _select(self, columns: str, days: float, country: Union[str, List[str], None] = None,
+                city: Union[str, List[str], None] = None, protocol: Optional[str] = None,
+                server: Optional[str] = None, order: str = 'server') -> List[tuple]:
+        clauses = ['measured_at >= ?']
+        params = [time.time() - days * 86400]
+        if server:
+            clauses.append('server = ?')
+            params.append(server)
+        for column, names in (('city', city), ('country', country)):
+            if names:
+                names = [names] if isinstance(names, str) else names
+                clauses.append('(' + ' OR '.join(f'{column} LIKE ?' for _ in names) + ')')
+                params.extend(f'%{name}%' for name in names)
+        if protocol:
+            clauses.append('protocol = ?')
+            params.append(protocol)
+        query = f"SELECT {columns} FROM measurements WHERE {' AND '.join(clauses)} ORDER BY {order}"
+        with self._lock:
+            return self.connection.execute(query, params).fetchall()
+    
+    def server_summaries(self, days: float = HISTORY_DAYS, **filters) -> List[Dict]:
+        summaries = {}
+        for server, country, city, protocol, download, measured_at in self._select(
+                'server, country, city, protocol, download, measured_at', days, **filters):
+            entry = summaries.setdefault(server, {'server': server, 'country': country, 'city': city,
+                                                  'protocol': protocol, 'downloads': [], 'last_seen': measured_at})
+            entry['downloads'].append(download)
+            entry['last_seen'] = max(entry['last_seen'], measured_at)
+        for entry in summaries.values():
+            entry['stats'] = summarize_samples(entry.pop('downloads'))
+        return sorted(summaries.values(), key=lambda entry: entry['stats']['median'], reverse=True)
+    
+    def strength(self, days: float = HISTORY_DAYS) -> Dict[str, float]:
+        return {entry['server']: entry['stats']['median'] for entry in self.server_summaries(days)}
+    
+    def window(self, since: float, until: float):
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT server, country, city, download, upload, ping FROM measurements '
+                'WHERE measured_at >= ? AND measured_at < ? ORDER BY server', (since, until)).fetchall()
+        return rows
+    
+    def trend(self, server: str, days: float = HISTORY_DAYS) -> List[Dict]:
+        days_seen = {}
+        for day, download, upload, ping in self._select(
+                "date(measured_at, 'unixepoch', 'localtime'), download, upload, ping", days,
+                server=server, order='measured_at'):
+            samples = days_seen.setdefault(day, {'download': [], 'upload': [], 'ping': []})
+            samples['download'].append(download)
+            samples['upload'].append(upload)
+            samples['ping'].append(ping)
+        return [{'day': day, 'n': len(samples['download']),
+                 'download': median(samples['download']), 'upload': median(samples['upload']),
+                 'ping': median(samples['ping'])} for day, samples in days_seen.items()]
+    
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+class TraceSpan:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+    
+    def __init__(self, tracer: 'Tracer', name: str, args: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+    
+    def __enter__(self) -> 'TraceSpan':
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, self.args)
+        return False
+
+class Tracer:
+    def __init__(self, capacity: int = TRACE_CAPACITY):
+        self.events = deque(maxlen=capacity)
+        self.counters = {}
+        self.origin = time.perf_counter()
+    
+    def span(self, name: str, **args) -> TraceSpan:
+        return TraceSpan(self, name, args)
+    
+    def record(self, name: str, start: float, args: Optional[Dict] = None):
+        self.events.append((name, start, time.perf_counter(), threading.get_ident(), args or {}))
+    
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def reset(self):
+        self.events.clear()
+        self.counters.clear()
+        self.origin = time.perf_counter()
+    
+    def summary(self) -> List[Dict]:
+        durations = {}
+        for name, start, end, _, _ in list(self.events):
+            durations.setdefault(name, []).append(end - start)
+        rows = []
+        for name, values in durations.items():
+            ordered = sorted(values)
+            rows.append({'phase': name, 'count': len(ordered), 'total': sum(ordered),
+                         'mean': sum(ordered) / len(ordered), 'p50': percentile(ordered, 0.5),
+                         'p95': percentile(ordered, 0.95), 'max': ordered[-1]})
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+    
+    def chrome_trace(self) -> Dict:
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, start, end, thread, args in list(self.events):
+            events.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid,
+                           'tid': threads.setdefault(thread, len(threads) + 1),
+                           'ts': round((start - self.origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                           'args': args})
+        if self.counters:
+            events.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0,
+                           'ts': round((time.perf_counter() - self.origin) * 1e6, 1), 'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    
+    def save(self, path: str):
+        write_json_atomic(os.path.abspath(path), self.chrome_trace())
+
+TRACER = Tracer()
+
 class Colors:
     if sys.stdout.isatty() and (not IS_WINDOWS or 'ANSICON' in os.environ or 'WT_SESSION' in os.environ):
         HEADER = '\033[95m'
@@ -29,6 +421,191 @@ class Colors:
     else:
         HEADER = BLUE = CYAN = GREEN = YELLOW = RED = END = BOLD = ''
 
+def parse_host_port(value: str, default_port: int) -> Tuple[str, int]:
+    host, sep, port = value.rpartition(':')
+    if sep and port.isdigit() and host:
+        return host.strip('[]'), int(port)
+    return value, default_port
+
+def tcp_connect_rtt(address: str, port: int, timeout: float) -> Optional[float]:
+    started = time.perf_counter()
+    try:
+        with socket.create_connection((address, port), timeout=timeout):
+            pass
+    except ConnectionRefusedError:
+        pass
+    except OSError:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+def udp_echo_rtt(address: str, port: int, timeout: float) -> Optional[float]:
+    seq = random.getrandbits(64)
+    frame = seq.to_bytes(8, 'big') + time.time_ns().to_bytes(8, 'big')
+    try:
+        family, kind, proto, _, target = socket.getaddrinfo(address, port, 0, socket.SOCK_DGRAM)[0]
+        with socket.socket(family, kind, proto) as sock:
+            sock.settimeout(timeout)
+            sock.connect(target)
+            started = time.perf_counter()
+            sock.send(frame)
+            deadline = started + timeout
+            while True:
+                try:
+                    data = sock.recv(64)
+                except (ConnectionRefusedError, ConnectionResetError):
+                    break
+                if data[:8] == frame[:8]:
+                    break
+                sock.settimeout(max(0.001, deadline - time.perf_counter()))
+    except OSError:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+def relay_unreachable(address: str, port: int, attempts: int = None, timeout: float = 1.0) -> bool:
+    for attempt in range(attempts or LIVENESS_ATTEMPTS):
+        if attempt:
+            time.sleep(timeout / 2)
+        if tcp_connect_rtt(address, port, timeout) is not None:
+            return False
+    return True
+
+def median(values: List[float]) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+T_CRITICAL_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+                 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042, 60: 2.000}
+
+def t_critical(df: int) -> float:
+    for bound in sorted(T_CRITICAL_95):
+        if df <= bound:
+            return T_CRITICAL_95[bound]
+    return 1.96
+
+def mean_confidence_interval(values: List[float]) -> Tuple[float, Optional[float], Optional[float]]:
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, None, None
+    variance = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+    margin = t_critical(len(values) - 1) * (variance / len(values)) ** 0.5
+    return mean, mean - margin, mean + margin
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize_samples(values: List[float]) -> Dict:
+    ordered = sorted(values)
+    count = len(ordered)
+    mean = sum(ordered) / count
+    stddev = (sum((v - mean) ** 2 for v in ordered) / (count - 1)) ** 0.5 if count > 1 else 0.0
+    margin = t_critical(count - 1) * stddev / count ** 0.5 if count > 1 else None
+    return {
+        'n': count,
+        'median': round(percentile(ordered, 0.5), 2),
+        'mean': round(mean, 2),
+        'p10': round(percentile(ordered, 0.1), 2),
+        'p90': round(percentile(ordered, 0.9), 2),
+        'stddev': round(stddev, 2),
+        'ci95': [round(mean - margin, 2), round(mean + margin, 2)] if margin is not None else None
+    }
+
+def average_ranks(values: List[float]) -> List[float]:
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+def rank_correlation(xs: List[float], ys: List[float]) -> Optional[float]:
+    if len(xs) < 3:
+        return None
+    rx = average_ranks(xs)
+    ry = average_ranks(ys)
+    mean_x = sum(rx) / len(rx)
+    mean_y = sum(ry) / len(ry)
+    cov = sum((a - mean_x) * (b - mean_y) for a, b in zip(rx, ry))
+    var_x = sum((a - mean_x) ** 2 for a in rx)
+    var_y = sum((b - mean_y) ** 2 for b in ry)
+    if not var_x or not var_y:
+        return None
+    return cov / (var_x * var_y) ** 0.5
+
+_exact_u_memo = {}
+
+def _exact_u_counts(m: int, n: int) -> List[int]:
+    if m == 0 or n == 0:
+        return [1]
+    memo = _exact_u_memo
+    if (m, n) not in memo:
+        shifted = _exact_u_counts(m - 1, n)
+        kept = _exact_u_counts(m, n - 1)
+        counts = [0] * (m * n + 1)
+        for u, ways in enumerate(shifted):
+            counts[u + n] += ways
+        for u, ways in enumerate(kept):
+            counts[u] += ways
+        memo[(m, n)] = counts
+    return memo[(m, n)]
+
+def mann_whitney(baseline: List[float], current: List[float]) -> Tuple[float, float]:
+    n1, n2 = len(baseline), len(current)
+    pooled = list(baseline) + list(current)
+    ranks = average_ranks(pooled)
+    u = sum(ranks[n1:]) - n2 * (n2 + 1) / 2
+    total = n1 + n2
+    ties = {}
+    for value in pooled:
+        ties[value] = ties.get(value, 0) + 1
+    tie_term = sum(t ** 3 - t for t in ties.values())
+    
+    if not tie_term and total <= MWU_EXACT_LIMIT:
+        counts = _exact_u_counts(n1, n2)
+        below = sum(counts[:int(u) + 1])
+        above = sum(counts[int(u):])
+        return u, min(1.0, 2 * min(below, above) / sum(counts))
+    
+    variance = n1 * n2 / 12 * ((total + 1) - tie_term / (total * (total - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = max(0.0, abs(u - n1 * n2 / 2) - 0.5) / variance ** 0.5
+    return u, min(1.0, math.erfc(z / 2 ** 0.5))
+
+def min_mann_whitney_p(n1: int, n2: int) -> float:
+    return min(1.0, 2 * math.factorial(n1) * math.factorial(n2) / math.factorial(n1 + n2))
+
+def cliffs_delta(u: float, n1: int, n2: int) -> float:
+    return 2 * u / (n1 * n2) - 1
+
+def effect_magnitude(delta: float) -> str:
+    for threshold, label in CLIFF_MAGNITUDES:
+        if abs(delta) >= threshold:
+            return label
+    return 'negligible'
+
+def benjamini_hochberg(p_values: List[float]) -> List[float]:
+    count = len(p_values)
+    order = sorted(range(count), key=lambda i: p_values[i], reverse=True)
+    adjusted = [1.0] * count
+    running = 1.0
+    for position, i in enumerate(order):
+        running = min(running, p_values[i] * count / (count - position))
+        adjusted[i] = running
+    return adjusted
+
 def show_splash_screen():
     bears = f"""
 {Colors.CYAN}
@@ -43,37 +620,1281 @@ def show_splash_screen():
 """
     
     print(bears)
+
+class Relay:
+    __slots__ = ('country', 'city', 'server', 'provider', 'ipv4', 'ipv6', 'owned', 'hoster', 'active', 'weight',
+                 'latitude', 'longitude')
+    
+    def __init__(self, country: str, city: str, server: str, provider: str, ipv4: str = None, ipv6: str = None,
+                 owned: Optional[bool] = None, hoster: Optional[str] = None, active: Optional[bool] = True,
+                 weight: Optional[int] = None, latitude: Optional[float] = None, longitude: Optional[float] = None):
+        self.country = country
+        self.city = city
+        self.server = server
+        self.provider = provider
+        self.ipv4 = ipv4
+        self.ipv6 = ipv6
+        self.owned = owned
+        self.hoster = hoster
+        self.active = active
+        self.weight = weight
+        self.latitude = latitude
+        self.longitude = longitude
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+    
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Relay':
+        return cls(**{key: data[key] for key in cls.__slots__ if key in data})
+    
+    def __repr__(self):
+        return f"Relay({self.server!r}, {self.city!r}, {self.country!r}, {self.provider!r})"
+
+class RelayCatalog:
+    def __init__(self, relays: List[Relay]):
+        self.relays = relays
+        self.locations = {}
+        self.by_protocol = {}
+        self.by_server = {}
+        self._coordinates = None
+        
+        for relay in relays:
+            cities = self.locations.setdefault(relay.country, {})
+            city_index = cities.setdefault(relay.city, {None: []})
+            city_index[None].append(relay)
+            city_index.setdefault(relay.provider, []).append(relay)
+            self.by_protocol.setdefault(relay.provider, []).append(relay)
+            self.by_server[relay.server] = relay
+        
+        self.country_counts = {country: sum(len(index[None]) for index in cities.values())
+                               for country, cities in self.locations.items()}
+        self.countries = sorted(self.locations)
+        self.cities = {country: sorted((city, len(index[None])) for city, index in cities.items())
+                       for country, cities in self.locations.items()}
+        self.country_lookup = self._build_lookup(self.locations)
+        self.city_lookup = self._build_lookup({city for cities in self.locations.values() for city in cities})
+    
+    @staticmethod
+    def _build_lookup(names) -> Dict[str, frozenset]:
+        lookup = {}
+        for name in names:
+            lowered = name.lower()
+            for start in range(len(lowered)):
+                for end in range(start + 1, len(lowered) + 1):
+                    lookup.setdefault(lowered[start:end], set()).add(name)
+        return {key: frozenset(value) for key, value in lookup.items()}
+    
+    def match_countries(self, query: Union[str, List[str]]) -> frozenset:
+        return self._match(self.country_lookup, query)
+    
+    def match_cities(self, query: Union[str, List[str]]) -> frozenset:
+        return self._match(self.city_lookup, query)
+    
+    @staticmethod
+    def _match(lookup: Dict[str, frozenset], query: Union[str, List[str]]) -> frozenset:
+        if isinstance(query, str):
+            return lookup.get(query.lower(), frozenset())
+        return frozenset().union(*(lookup.get(name.lower(), frozenset()) for name in query))
+    
+    def filter(self, country: Union[str, List[str]] = None, city: Union[str, List[str]] = None,
+               provider: str = None) -> List[Relay]:
+        if not country and not city and not provider:
+            return list(self.relays)
+        
+        countries = self.match_countries(country) if country else None
+        cities = self.match_cities(city) if city else None
+        key = provider.lower() if provider else None
+        
+        if countries is None and cities is None:
+            return list(self.by_protocol.get(key, []))
+        
+        relays = []
+        for country_name, country_cities in self.locations.items():
+            if countries is not None and country_name not in countries:
+                continue
+            for city_name, index in country_cities.items():
+                if cities is not None and city_name not in cities:
+                    continue
+                relays.extend(index.get(key, []))
+        return relays
+    
+    def coordinates(self) -> Tuple[List[Relay], object, object]:
+        if self._coordinates is None:
+            located = [relay for relay in self.relays if relay.latitude is not None and relay.longitude is not None]
+            latitudes = [math.radians(relay.latitude) for relay in located]
+            longitudes = [math.radians(relay.longitude) for relay in located]
+            numpy = load_numpy()
+            if numpy:
+                latitudes, longitudes = numpy.array(latitudes), numpy.array(longitudes)
+            self._coordinates = (located, latitudes, longitudes)
+        return self._coordinates
+    
+    def nearest(self, latitude: float, longitude: float, count: int,
+                relays: Optional[List[Relay]] = None) -> List[Tuple[Relay, float]]:
+        located, latitudes, longitudes = self.coordinates()
+        if not located:
+            return []
+        distances = great_circle_km(latitude, longitude, latitudes, longitudes)
+        numpy = load_numpy()
+        if numpy:
+            order = numpy.argsort(distances, kind='stable').tolist()
+        else:
+            order = sorted(range(len(located)), key=distances.__getitem__)
+        
+        allowed = None if relays is None else {relay['server'] for relay in relays}
+        ranked = []
+        for index in order:
+            relay = located[index]
+            if allowed is None or relay.server in allowed:
+                ranked.append((relay, float(distances[index])))
+                if len(ranked) == count:
+                    break
+        return ranked
+    
+    def __len__(self):
+        return len(self.relays)
+
+_numpy_module = None
+
+def load_numpy():
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+def great_circle_km(latitude: float, longitude: float, latitudes, longitudes):
+    origin_latitude, origin_longitude = math.radians(latitude), math.radians(longitude)
+    numpy = load_numpy()
+    if numpy and isinstance(latitudes, numpy.ndarray):
+        half_dlat = numpy.sin((latitudes - origin_latitude) / 2)
+        half_dlon = numpy.sin((longitudes - origin_longitude) / 2)
+        a = half_dlat ** 2 + math.cos(origin_latitude) * numpy.cos(latitudes) * half_dlon ** 2
+        return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+    
+    cos_origin = math.cos(origin_latitude)
+    distances = []
+    for lat, lon in zip(latitudes, longitudes):
+        a = math.sin((lat - origin_latitude) / 2) ** 2 + cos_origin * math.cos(lat) * math.sin((lon - origin_longitude) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+def estimate_client_location(timeout: float = 5.0) -> Optional[Dict]:
+    import http.client
+    connection = http.client.HTTPSConnection(TRAFFIC_PROBE[0], timeout=timeout)
+    try:
+        connection.request('GET', '/json')
+        response = connection.getresponse()
+        if response.status != 200:
+            return None
+        data = json.loads(response.read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+    if data.get('latitude') is None or data.get('longitude') is None:
+        return None
+    return data
+
+_speedtest_module = None
+
+def load_speedtest_module():
+    global _speedtest_module
+    if _speedtest_module is None:
+        try:
+            import speedtest
+            _speedtest_module = speedtest
+        except ImportError:
+            _speedtest_module = False
+    return _speedtest_module or None
+
+def kill_process_tree(process: subprocess.Popen):
+    try:
+        if IS_WINDOWS:
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, ProcessLookupError):
+        pass
+
+class ThroughputBackend:
+    name = 'base'
+    stop_event = None
+    process = None
+    
+    def cancel(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            kill_process_tree(process)
+            process.wait()
+    
+    def _run_process(self, command: List[str], timeout: float) -> subprocess.CompletedProcess:
+        if self.stop_event.is_set():
+            raise RuntimeError('measurement cancelled')
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   start_new_session=not IS_WINDOWS)
+        self.process = process
+        if self.stop_event.is_set():
+            kill_process_tree(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process)
+            process.communicate()
+            raise
+        finally:
+            self.process = None
+        if self.stop_event.is_set():
+            raise RuntimeError('measurement cancelled')
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+    
+    def describe(self) -> str:
+        return self.name
     
-    for i in range(3):
-        print(f"{Colors.GREEN}{'.' * (i+1)}{Colors.END}", end='\r')
-        time.sleep(0.6)
+    def expected_seconds(self, duration: Optional[float] = None) -> float:
+        return 2 * (duration or 10.0) + 5.0
     
-    print(f"{Colors.GREEN}Loading complete!{Colors.END}")
-    time.sleep(0.5)
-    os.system('cls' if IS_WINDOWS else 'clear')
+    def check(self) -> bool:
+        return True
+    
+    def measure(self, location_key: Optional[str] = None, duration: Optional[float] = None) -> Dict:
+        raise NotImplementedError
+    
+    def latency_samples(self, host: str, port: int, count: int = 5, timeout: float = 2.0) -> List[float]:
+        samples = []
+        for _ in range(count):
+            rtt = tcp_connect_rtt(host, port, timeout)
+            if rtt is not None:
+                samples.append(round(rtt, 3))
+        return samples
+
+class SpeedtestBackend(ThroughputBackend):
+    name = 'speedtest'
+    
+    def __init__(self, server_id: Optional[int] = None, timeout: int = 10, secure: bool = False,
+                 nearby_km: float = 1000.0):
+        self.server_id = server_id
+        self.timeout = timeout
+        self.secure = secure
+        self.nearby_km = nearby_km
+        self.stop_event = threading.Event()
+        self.client = None
+        self.servers = {}
+        self.location_key = None
+        self.best = None
+        self.server_list_downloads = 0
+    
+    def _refresh_client(self, speedtest):
+        if self.client is None:
+            self.client = speedtest.Speedtest(timeout=self.timeout, secure=self.secure,
+                                              shutdown_event=self.stop_event)
+        else:
+            self.client.get_config()
+    
+    def _closest_servers(self, speedtest, limit: int = 5) -> List[Dict]:
+        origin = self.client.lat_lon
+        ranked = []
+        for server in self.servers.values():
+            server['d'] = speedtest.distance(origin, (float(server['lat']), float(server['lon'])))
+            ranked.append(server)
+        ranked.sort(key=lambda server: server['d'])
+        return ranked[:limit]
+    
+    def describe(self) -> str:
+        if self.server_id:
+            return f"speedtest.net server {self.server_id} (pinned)"
+        return "speedtest.net (nearest server per exit location)"
+    
+    def _select_pinned_server(self, speedtest) -> Dict:
+        self._refresh_client(speedtest)
+        self.client.servers = {}
+        pinned = [server for servers in self.client.get_servers([self.server_id]).values() for server in servers]
+        self.server_list_downloads += 1
+        self.client._best = {}
+        self.best = self.client.get_best_server(pinned)
+        return self.best
+    
+    def select_server(self, location_key: Optional[str] = None) -> Dict:
+        speedtest = load_speedtest_module()
+        if self.server_id:
+            return self.best or self._select_pinned_server(speedtest)
+        
+        if self.best and location_key is not None and location_key == self.location_key:
+            return self.best
+        
+        self._refresh_client(speedtest)
+        closest = self._closest_servers(speedtest)
+        if not closest or closest[0]['d'] > self.nearby_km:
+            self.client.servers = {}
+            for servers in self.client.get_servers().values():
+                for server in servers:
+                    self.servers[server['id']] = server
+            self.server_list_downloads += 1
+            closest = self._closest_servers(speedtest)
+        
+        self.client.closest = closest
+        self.client._best = {}
+        self.best = self.client.get_best_server(closest)
+        self.location_key = location_key
+        return self.best
+    
+    def _latency_samples(self, speedtest, count: int = 5) -> List[float]:
+        url = os.path.dirname(self.best['url'])
+        samples = []
+        for i in range(count):
+            request = speedtest.build_request(f"{url}/latency.txt?x={int(time.time() * 1000)}.{i}",
+                                              secure=self.secure)
+            started = time.perf_counter()
+            response, error = speedtest.catch_request(request, opener=self.client._opener)
+            if error:
+                continue
+            response.read(9)
+            samples.append(round((time.perf_counter() - started) * 1000, 3))
+        return samples
+    
+    def measure(self, location_key: Optional[str] = None, duration: Optional[float] = None) -> Dict:
+        speedtest = load_speedtest_module()
+        self.stop_event.clear()
+        started = time.perf_counter()
+        with TRACER.span('speedtest.select_server'):
+            self.select_server(location_key)
+        length = dict(self.client.config['length'])
+        if duration:
+            self.client.config['length'] = {'download': duration, 'upload': duration}
+        self.client.results = speedtest.SpeedtestResults(client=self.client.config['client'],
+                                                         opener=self.client._opener, secure=self.secure)
+        self.client.results.server = self.best
+        self.client.results.ping = self.best['latency']
+        setup_seconds = time.perf_counter() - started
+        
+        with TRACER.span('speedtest.latency'):
+            latency_samples = self._latency_samples(speedtest)
+        
+        try:
+            started = time.perf_counter()
+            with TRACER.span('speedtest.download'):
+                self.client.download()
+            download_seconds = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            with TRACER.span('speedtest.upload'):
+                self.client.upload(pre_allocate=False)
+            upload_seconds = time.perf_counter() - started
+        finally:
+            self.client.config['length'] = length
+        
+        results = self.client.results
+        ping = median(latency_samples) if latency_samples else results.ping
+        return {
+            'ping': ping,
+            'download': results.download / 1e6,
+            'upload': results.upload / 1e6,
+            'bytes_received': results.bytes_received,
+            'bytes_sent': results.bytes_sent,
+            'setup_seconds': round(setup_seconds, 3),
+            'download_seconds': round(download_seconds, 3),
+            'upload_seconds': round(upload_seconds, 3),
+            'latency_samples': latency_samples,
+            'test_server': {
+                'id': self.best.get('id'),
+                'sponsor': self.best.get('sponsor'),
+                'name': self.best.get('name'),
+                'country': self.best.get('country'),
+                'host': self.best.get('host'),
+                'distance_km': round(self.best.get('d', 0.0), 1)
+            }
+        }
+
+class SpeedtestCliBackend(ThroughputBackend):
+    name = 'speedtest-cli'
+    
+    def __init__(self, server_id: Optional[int] = None, timeout: int = 60):
+        self.server_id = server_id
+        self.timeout = timeout
+        self.stop_event = threading.Event()
+    
+    def describe(self) -> str:
+        if self.server_id:
+            return f"speedtest-cli, server {self.server_id} (pinned)"
+        return "speedtest-cli (nearest server per exit location)"
+    
+    def check(self) -> bool:
+        try:
+            subprocess.run(['speedtest-cli', '--version'], capture_output=True, check=True)
+            return True
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return False
+    
+    def measure(self, location_key: Optional[str] = None, duration: Optional[float] = None) -> Optional[Dict]:
+        command = ['speedtest-cli', '--simple']
+        if self.server_id:
+            command += ['--server', str(self.server_id)]
+        self.stop_event.clear()
+        with TRACER.span('speedtest-cli.run'):
+            result = self._run_process(command, self.timeout)
+        result.check_returncode()
+        
+        metrics = {}
+        for line in result.stdout.strip().split('\n'):
+            if 'Ping:' in line:
+                metrics['ping'] = float(line.split(':')[1].strip().split()[0])
+            elif 'Download:' in line:
+                metrics['download'] = float(line.split(':')[1].strip().split()[0])
+            elif 'Upload:' in line:
+                metrics['upload'] = float(line.split(':')[1].strip().split()[0])
+        
+        if all(k in metrics for k in ['ping', 'download', 'upload']):
+            return metrics
+        return None
+
+class HttpBackend(ThroughputBackend):
+    name = 'http'
+    
+    def __init__(self, download_url: Union[str, List[str]], upload_url: Optional[str] = None, duration: float = 10.0,
+                 timeout: float = 10.0, chunk_size: int = 256 * 1024, upload_block: int = 4 * 1024 * 1024,
+                 streams: int = 1):
+        self.download_urls = [download_url] if isinstance(download_url, str) else list(download_url)
+        self.download_url = self.download_urls[0]
+        self.upload_urls = [upload_url] if upload_url else [self.default_upload_url(url) for url in self.download_urls]
+        self.upload_url = self.upload_urls[0]
+        self.duration = duration
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.upload_block = upload_block
+        self.streams = max(1, streams)
+        self.stop_event = threading.Event()
+    
+    @staticmethod
+    def default_upload_url(download_url: str) -> str:
+        parts = urlsplit(download_url)
+        path = parts.path
+        if path.rstrip('/').endswith('download'):
+            path = path.rstrip('/')[:-len('download')] + 'upload'
+        return urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+    
+    def describe(self) -> str:
+        targets = self.download_url if len(self.download_urls) == 1 else f"{len(self.download_urls)} targets"
+        streams = f", {self.streams} streams" if self.streams > 1 else ''
+        return f"HTTP {targets} (upload {self.upload_url}{streams})"
+    
+    def expected_seconds(self, duration: Optional[float] = None) -> float:
+        return 2 * (duration or self.duration) + 1.0
+    
+    def _connect(self, url: str):
+        import http.client
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            connection = http.client.HTTPSConnection(parts.hostname, parts.port or 443, timeout=self.timeout)
+        else:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=self.timeout)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        return connection, path
+    
+    def _endpoint(self, url: str) -> Tuple[str, int]:
+        parts = urlsplit(url)
+        return parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+    
+    def _download_stream(self, index: int, url: str, counts: List[int], start, stop_at: List[float]):
+        buffer = memoryview(bytearray(self.chunk_size))
+        connection, path = start(url)
+        while connection is not None:
+            try:
+                connection.request('GET', path, headers={'Cache-Control': 'no-cache'})
+                response = connection.getresponse()
+                if response.status >= 400:
+                    raise OSError(f"download returned HTTP {response.status}")
+                while time.perf_counter() < stop_at[0] and not self.stop_event.is_set():
+                    received = response.readinto(buffer)
+                    if not received:
+                        break
+                    counts[index] += received
+            finally:
+                connection.close()
+            if time.perf_counter() >= stop_at[0] or self.stop_event.is_set():
+                return
+            connection, path = self._connect(url)
+    
+    def _upload_stream(self, index: int, url: str, counts: List[int], start, stop_at: List[float]):
+        chunk = b'\0' * self.chunk_size
+        chunks = max(1, self.upload_block // self.chunk_size)
+        interrupted = []
+        
+        def body():
+            for _ in range(chunks):
+                if time.perf_counter() >= stop_at[0] or self.stop_event.is_set():
+                    interrupted.append(True)
+                    return
+                yield chunk
+                counts[index] += len(chunk)
+        
+        connection, path = start(url)
+        if connection is None:
+            return
+        try:
+            while not interrupted:
+                connection.request('POST', path, body=body(), headers={
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Length': str(chunks * len(chunk))
+                })
+                if interrupted:
+                    break
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    raise OSError(f"upload returned HTTP {response.status}")
+        finally:
+            connection.close()
+    
+    def _run_streams(self, stream, urls: List[str], duration: float) -> Dict:
+        counts = [0] * self.streams
+        errors = [None] * self.streams
+        stop_at = [float('inf')]
+        barrier = threading.Barrier(self.streams + 1)
+        
+        def start(url: str):
+            connection = None
+            try:
+                connection = self._connect(url)
+            finally:
+                try:
+                    barrier.wait(self.timeout * 2)
+                except threading.BrokenBarrierError:
+                    if connection is not None:
+                        connection[0].close()
+                    connection = None
+            return connection or (None, None)
+        
+        def run(index: int):
+            try:
+                stream(index, urls[index % len(urls)], counts, start, stop_at)
+            except Exception as e:
+                errors[index] = e
+        
+        threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(self.streams)]
+        for thread in threads:
+            thread.start()
+        stop_at[0] = time.perf_counter() + self.timeout * 2 + duration
+        try:
+            barrier.wait(self.timeout * 2)
+        except threading.BrokenBarrierError:
+            pass
+        started, cpu_started = time.perf_counter(), time.process_time()
+        stop_at[0] = started + duration
+        self.stop_event.wait(duration)
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        totals = list(counts)
+        for thread in threads:
+            thread.join(self.timeout)
+        
+        if not any(totals):
+            raise next((e for e in errors if e is not None), OSError('no data transferred'))
+        return {
+            'bytes': sum(totals),
+            'seconds': elapsed,
+            'streams': [round(count * 8 / elapsed / 1e6, 2) for count in totals],
+            'failed_streams': sum(1 for e in errors if e is not None),
+            'cpu_percent': round(cpu / elapsed * 100, 1)
+        }
+    
+    def measure(self, location_key: Optional[str] = None, duration: Optional[float] = None) -> Dict:
+        self.stop_event.clear()
+        duration = duration or self.duration
+        host, port = self._endpoint(self.download_url)
+        with TRACER.span('http.latency'):
+            latency_samples = self.latency_samples(host, port)
+        
+        with TRACER.span('http.download', streams=self.streams):
+            download = self._run_streams(self._download_stream, self.download_urls, duration)
+        with TRACER.span('http.upload', streams=self.streams):
+            upload = self._run_streams(self._upload_stream, self.upload_urls, duration)
+        
+        metrics = {
+            'ping': median(latency_samples) if latency_samples else 0.0,
+            'download': download['bytes'] * 8 / download['seconds'] / 1e6,
+            'upload': upload['bytes'] * 8 / upload['seconds'] / 1e6,
+            'bytes_received': download['bytes'],
+            'bytes_sent': upload['bytes'],
+            'download_seconds': round(download['seconds'], 3),
+            'upload_seconds': round(upload['seconds'], 3),
+            'latency_samples': latency_samples,
+            'client_cpu': {'download': download['cpu_percent'], 'upload': upload['cpu_percent']},
+            'test_server': {'host': f"{host}:{port}", 'name': self.download_url}
+        }
+        if self.streams > 1:
+            metrics['streams'] = {'count': self.streams, 'download': download['streams'], 'upload': upload['streams'],
+                                  'failed': download['failed_streams'] + upload['failed_streams']}
+        return metrics
+
+class Iperf3Backend(ThroughputBackend):
+    name = 'iperf3'
+    
+    def __init__(self, host: str, port: int = 5201, duration: float = 10.0, streams: int = 1):
+        self.host = host
+        self.port = port
+        self.duration = duration
+        self.streams = max(1, streams)
+        self.stop_event = threading.Event()
+    
+    def describe(self) -> str:
+        return f"iperf3 {self.host}:{self.port}" + (f" ({self.streams} streams)" if self.streams > 1 else '')
+    
+    def expected_seconds(self, duration: Optional[float] = None) -> float:
+        return 2 * max(1, int(duration or self.duration)) + 1.0
+    
+    def check(self) -> bool:
+        try:
+            subprocess.run(['iperf3', '--version'], capture_output=True, check=True)
+            return True
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return False
+    
+    def _run(self, reverse: bool, duration: float) -> Dict:
+        command = ['iperf3', '-c', self.host, '-p', str(self.port), '-t', str(max(1, int(duration))), '-J']
+        if self.streams > 1:
+            command += ['-P', str(self.streams)]
+        if reverse:
+            command.append('-R')
+        result = self._run_process(command, duration + 30)
+        report = json.loads(result.stdout)
+        if 'error' in report:
+            raise OSError(report['error'])
+        summary = dict(report['end']['sum_received'])
+        summary['streams'] = [round(stream['receiver']['bits_per_second'] / 1e6, 2)
+                              for stream in report['end'].get('streams', []) if 'receiver' in stream]
+        summary['cpu_percent'] = report['end'].get('cpu_utilization_percent', {}).get('host_total')
+        return summary
+    
+    def measure(self, location_key: Optional[str] = None, duration: Optional[float] = None) -> Dict:
+        duration = duration or self.duration
+        self.stop_event.clear()
+        with TRACER.span('iperf3.latency'):
+            latency_samples = self.latency_samples(self.host, self.port)
+        with TRACER.span('iperf3.download'):
+            download = self._run(reverse=True, duration=duration)
+        with TRACER.span('iperf3.upload'):
+            upload = self._run(reverse=False, duration=duration)
+        
+        metrics = {
+            'ping': median(latency_samples) if latency_samples else 0.0,
+            'download': download['bits_per_second'] / 1e6,
+            'upload': upload['bits_per_second'] / 1e6,
+            'bytes_received': download['bytes'],
+            'bytes_sent': upload['bytes'],
+            'download_seconds': round(download['seconds'], 3),
+            'upload_seconds': round(upload['seconds'], 3),
+            'latency_samples': latency_samples,
+            'client_cpu': {'download': download['cpu_percent'], 'upload': upload['cpu_percent']},
+            'test_server': {'host': f"{self.host}:{self.port}", 'name': 'iperf3'}
+        }
+        if self.streams > 1:
+            metrics['streams'] = {'count': self.streams, 'download': download['streams'],
+                                  'upload': upload['streams'], 'failed': 0}
+        return metrics
+
+BACKENDS = ['speedtest', 'speedtest-cli', 'http', 'iperf3']
+
+def make_backend(name: str, target: Optional[str] = None, upload_url: Optional[str] = None,
+                 duration: float = 10.0, streams: int = 1) -> ThroughputBackend:
+    if name == 'http':
+        if not target:
+            raise ValueError('--target URL is required for the http backend')
+        return HttpBackend([url.strip() for url in target.split(',') if url.strip()], upload_url, duration,
+                           streams=streams)
+    if name == 'iperf3':
+        if not target:
+            raise ValueError('--target HOST[:PORT] is required for the iperf3 backend')
+        host, port = parse_host_port(target, 5201)
+        return Iperf3Backend(host, port, duration, streams)
+    
+    server_id = int(target) if target else None
+    if name == 'speedtest' and load_speedtest_module():
+        return SpeedtestBackend(server_id)
+    return SpeedtestCliBackend(server_id)
+
+class LatencyProbe:
+    FRAME = 16
+    
+    def __init__(self, host: str, port: int, protocol: str = 'udp', rate: float = ECHO_RATE,
+                 timeout: float = ECHO_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.interval = 1.0 / max(rate, 0.1)
+        self.timeout = timeout
+        self.phase = 'idle'
+        self.sent = {}
+        self.rtts = {}
+        self.sock = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._drain_until = None
+        self._threads = []
+    
+    def start(self):
+        if self.protocol == 'tcp':
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            family, kind, proto, _, address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_DGRAM)[0]
+            self.sock = socket.socket(family, kind, proto)
+            self.sock.connect(address)
+        self.sock.settimeout(0.2)
+        self._threads = [threading.Thread(target=self._send_loop, daemon=True),
+                         threading.Thread(target=self._receive_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+    
+    def mark(self, phase: str):
+        with self._lock:
+            self.phase = phase
+    
+    def _send_loop(self):
+        seq = 0
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            with self._lock:
+                self.sent[seq] = (self.phase, time.perf_counter())
+            try:
+                self.sock.sendall(seq.to_bytes(8, 'big') + time.time_ns().to_bytes(8, 'big'))
+            except socket.timeout:
+                pass
+            except OSError:
+                if self.protocol == 'tcp':
+                    return
+            seq += 1
+            next_at += self.interval
+            self._stop.wait(max(0.0, next_at - time.perf_counter()))
+    
+    def _receive_loop(self):
+        pending = b''
+        while True:
+            if self._stop.is_set():
+                with self._lock:
+                    drained = len(self.rtts) >= len(self.sent)
+                if drained or time.perf_counter() >= self._drain_until:
+                    return
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.protocol == 'tcp' or self._stop.is_set():
+                    return
+                continue
+            arrived = time.perf_counter()
+            if self.protocol == 'tcp':
+                if not data:
+                    return
+                pending += data
+                frames = len(pending) // self.FRAME
+                data, pending = pending[:frames * self.FRAME], pending[frames * self.FRAME:]
+            elif len(data) != self.FRAME:
+                continue
+            with self._lock:
+                for offset in range(0, len(data), self.FRAME):
+                    seq = int.from_bytes(data[offset:offset + 8], 'big')
+                    entry = self.sent.get(seq)
+                    if entry is not None and seq not in self.rtts:
+                        self.rtts[seq] = (arrived - entry[1]) * 1000
+    
+    def stop(self) -> Dict:
+        self._drain_until = time.perf_counter() + self.timeout
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(self.timeout + 1.0)
+        if self.sock is not None:
+            self.sock.close()
+        return self.summary()
+    
+    def summary(self) -> Dict:
+        phases = {}
+        with self._lock:
+            for seq, (phase, _) in sorted(self.sent.items()):
+                entry = phases.setdefault(phase, {'sent': 0, 'rtts': []})
+                entry['sent'] += 1
+                rtt = self.rtts.get(seq)
+                if rtt is not None and rtt <= self.timeout * 1000:
+                    entry['rtts'].append(rtt)
+        
+        summary = {}
+        for phase, entry in phases.items():
+            rtts = entry['rtts']
+            ordered = sorted(rtts)
+            stats = {'sent': entry['sent'], 'received': len(rtts),
+                     'loss': round((1 - len(rtts) / entry['sent']) * 100, 2)}
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                stats[name] = round(percentile(ordered, fraction), 2) if ordered else None
+            stats['jitter'] = (round(sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1), 2)
+                               if len(rtts) > 1 else None)
+            summary[phase] = stats
+        return summary
+
+def latency_under_load_metrics(summary: Dict) -> Dict:
+    idle = summary.get('idle', {})
+    loaded = summary.get('loaded', {})
+    metrics = {
+        'idle_ping': idle.get('p50'),
+        'loaded_ping': loaded.get('p50'),
+        'loaded_ping_p99': loaded.get('p99'),
+        'jitter': loaded.get('jitter'),
+        'loss': loaded.get('loss'),
+        'latency_under_load': summary,
+    }
+    if metrics['idle_ping'] is not None and metrics['loaded_ping'] is not None:
+        metrics['bufferbloat'] = round(metrics['loaded_ping'] - metrics['idle_ping'], 2)
+    return metrics
+
+RANK_KEYS = {
+    'download': True,
+    'upload': True,
+    'ping': False,
+    'idle_ping': False,
+    'loaded_ping': False,
+    'loaded_ping_p99': False,
+    'bufferbloat': False,
+    'jitter': False,
+    'loss': False,
+}
+
+COMPARE_METRICS = ['download', 'upload', 'ping', 'loaded_ping', 'jitter', 'loss']
+
+LOAD_KEYS = ['idle_ping', 'loaded_ping', 'loaded_ping_p99', 'bufferbloat', 'jitter', 'loss']
+
+SCORE_PRESETS = {
+    'balanced': 'download:0.5,upload:0.25,ping:0.25',
+    'responsive': 'loaded_ping:0.4,jitter:0.2,loss:0.2,ping:0.2',
+}
+
+def parse_sort_keys(value: str) -> List[str]:
+    keys = [key.strip() for key in value.split(',') if key.strip()]
+    unknown = [key for key in keys if key not in RANK_KEYS]
+    if not keys or unknown:
+        raise argparse.ArgumentTypeError(f"unknown key {', '.join(unknown) or value!r} "
+                                         f"(choose from {', '.join(RANK_KEYS)})")
+    return keys
+
+def parse_score(value: str) -> Dict[str, float]:
+    weights = {}
+    for term in SCORE_PRESETS.get(value, value).split(','):
+        metric, _, weight = term.strip().partition(':')
+        if metric not in RANK_KEYS:
+            raise argparse.ArgumentTypeError(f"unknown metric {metric!r} (choose from {', '.join(RANK_KEYS)} "
+                                             f"or a preset: {', '.join(SCORE_PRESETS)})")
+        try:
+            weights[metric] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight for {metric} is not a number: {weight!r}")
+        if weights[metric] <= 0:
+            raise argparse.ArgumentTypeError(f"weight for {metric} must be positive")
+    return weights
+
+def composite_scores(results: List[Dict], weights: Dict[str, float]) -> Tuple[List[Optional[float]], Dict]:
+    bounds = {}
+    for metric in weights:
+        values = [r[metric] for r in results if r.get(metric) is not None]
+        if values:
+            bounds[metric] = (min(values), max(values))
+    total = sum(weights[metric] for metric in bounds)
+    scores = []
+    for result in results:
+        score = 0.0
+        for metric, (low, high) in bounds.items():
+            value = result.get(metric)
+            if value is None:
+                continue
+            normalized = (value - low) / (high - low) if high > low else 1.0
+            if high > low and not RANK_KEYS[metric]:
+                normalized = 1.0 - normalized
+            score += weights[metric] * normalized
+        scores.append(round(score / total * 100, 1) if total else None)
+    return scores, bounds
+
+def pareto_front(results: List[Dict], metrics: List[str]) -> List[int]:
+    vectors = [tuple(r[metric] if RANK_KEYS[metric] else -r[metric] for metric in metrics) for r in results]
+    order = sorted(range(len(vectors)), key=lambda i: (sum(vectors[i]), vectors[i]), reverse=True)
+    front = []
+    for i in order:
+        candidate = vectors[i]
+        if not any(vectors[j] != candidate and all(a >= b for a, b in zip(vectors[j], candidate)) for j in front):
+            front.append(i)
+    return sorted(front)
+
+def format_weights(weights: Dict[str, float]) -> str:
+    return ','.join(f"{metric}:{weight:g}" for metric, weight in weights.items())
+
+def find_key(node, key: str):
+    if isinstance(node, dict):
+        if key in node:
+            return node[key]
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+def load_device_wireguard_config(path: Optional[str] = None) -> Optional[Dict]:
+    path = path or os.path.join(MULLVAD_SETTINGS_DIR, 'device.json')
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    wg_data = find_key(data, 'wg_data')
+    if not isinstance(wg_data, dict) or not wg_data.get('private_key'):
+        return None
+    
+    private_key = wg_data['private_key']
+    if isinstance(private_key, list):
+        private_key = base64.b64encode(bytes(private_key)).decode()
+    
+    addresses = wg_data.get('addresses') or {}
+    return {
+        'private_key': private_key,
+        'addresses': [a for a in (addresses.get('ipv4_address'), addresses.get('ipv6_address')) if a]
+    }
+
+def load_relay_wireguard_peers(path: Optional[str] = None) -> Dict[str, Dict]:
+    path = path or default_relay_data_path()
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    
+    peers = {}
+    pending = [data]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        
+        if node.get('hostname'):
+            public_key = node.get('public_key')
+            for name, endpoint in (node.get('endpoint_data') or {}).items() if isinstance(node.get('endpoint_data'), dict) else ():
+                if name.lower() == 'wireguard' and isinstance(endpoint, dict):
+                    public_key = public_key or endpoint.get('public_key')
+            if public_key:
+                peers[node['hostname']] = {'public_key': public_key, 'ipv4': node.get('ipv4_addr_in')}
+        
+        pending.extend(value for value in node.values() if isinstance(value, (dict, list)))
+    
+    return peers
+
+def default_relay_data_path() -> str:
+    return os.path.join(MULLVAD_CACHE_DIR, 'relays.json')
+
+RELAY_ENDPOINTS = {'wireguard': 'wireguard', 'openvpn': 'openvpn'}
+
+def relay_protocol(relay: Dict) -> Optional[str]:
+    endpoint = relay.get('endpoint_data', relay.get('endpoint_type'))
+    if isinstance(endpoint, dict):
+        endpoint = next(iter(endpoint), None)
+    if isinstance(endpoint, str):
+        return RELAY_ENDPOINTS.get(endpoint.lower())
+    return 'wireguard' if '-wg-' in relay.get('hostname', '') else 'openvpn'
+
+def parse_relay_data(data: Dict) -> List[Relay]:
+    if isinstance(data.get('relays'), dict):
+        data = data['relays']
+    relays = []
+    append = relays.append
+    
+    if 'countries' in data:
+        for country in data['countries']:
+            country_name = country['name']
+            for city in country.get('cities', ()):
+                city_name, latitude, longitude = city['name'], city.get('latitude'), city.get('longitude')
+                for relay in city.get('relays', ()):
+                    get = relay.get
+                    protocol = relay_protocol(relay)
+                    if protocol and get('hostname'):
+                        append(Relay(country_name, city_name, relay['hostname'], protocol, get('ipv4_addr_in'),
+                                     get('ipv6_addr_in'), get('owned'), get('provider'), get('active', True),
+                                     get('weight'), latitude, longitude))
+        return relays
+    
+    locations = data.get('locations') or {}
+    for protocol in ('wireguard', 'openvpn'):
+        for relay in (data.get(protocol) or {}).get('relays', ()):
+            get = relay.get
+            location = locations.get(get('location'), {})
+            if get('hostname'):
+                append(Relay(location.get('country', ''), location.get('city', ''), relay['hostname'], protocol,
+                             get('ipv4_addr_in'), get('ipv6_addr_in'), get('owned'), get('provider'),
+                             get('active', True), get('weight'), location.get('latitude'), location.get('longitude')))
+    return relays
+
+def load_relay_data(path: Optional[str] = None) -> Optional[List[Relay]]:
+    try:
+        with open(path or default_relay_data_path(), 'rb') as f:
+            data = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    relays = parse_relay_data(data)
+    return relays or None
+
+class NamespaceTunnel:
+    def __init__(self, slot: int, private_key_file: str, addresses: List[str], public_key: str,
+                 endpoint: str, dns: str = MULLVAD_DNS, rate_mbit: Optional[float] = None):
+        self.namespace = f"tbi-ns{slot}"
+        self.interface = f"tbi-wg{slot}"
+        self.private_key_file = private_key_file
+        self.addresses = addresses
+        self.public_key = public_key
+        self.endpoint = endpoint
+        self.dns = dns
+        self.rate_mbit = rate_mbit
+    
+    def _run(self, command: List[str]):
+        subprocess.run(command, capture_output=True, text=True, check=True)
+    
+    def up(self):
+        self.down()
+        ns = self.namespace
+        iface = self.interface
+        
+        self._run(['ip', 'netns', 'add', ns])
+        self._run(['ip', 'link', 'add', iface, 'type', 'wireguard'])
+        self._run(['wg', 'set', iface, 'private-key', self.private_key_file,
+                   'peer', self.public_key, 'endpoint', self.endpoint,
+                   'allowed-ips', '0.0.0.0/0,::/0', 'persistent-keepalive', '25'])
+        self._run(['ip', 'link', 'set', iface, 'netns', ns])
+        for address in self.addresses:
+            self._run(['ip', '-n', ns, 'addr', 'add', address, 'dev', iface])
+        self._run(['ip', '-n', ns, 'link', 'set', 'lo', 'up'])
+        self._run(['ip', '-n', ns, 'link', 'set', iface, 'up'])
+        self._run(['ip', '-n', ns, 'route', 'add', 'default', 'dev', iface])
+        if any(':' in address for address in self.addresses):
+            self._run(['ip', '-n', ns, '-6', 'route', 'add', 'default', 'dev', iface])
+        
+        resolv_dir = os.path.join('/etc/netns', ns)
+        os.makedirs(resolv_dir, exist_ok=True)
+        with open(os.path.join(resolv_dir, 'resolv.conf'), 'w') as f:
+            f.write(f"nameserver {self.dns}\n")
+        
+        if self.rate_mbit:
+            rate = f"{self.rate_mbit:.3f}mbit"
+            self._run(['tc', '-n', ns, 'qdisc', 'add', 'dev', iface, 'root', 'tbf',
+                       'rate', rate, 'burst', '256kb', 'latency', '50ms'])
+            self._run(['tc', '-n', ns, 'qdisc', 'add', 'dev', iface, 'handle', 'ffff:', 'ingress'])
+            self._run(['tc', '-n', ns, 'filter', 'add', 'dev', iface, 'parent', 'ffff:', 'protocol', 'all',
+                       'u32', 'match', 'u32', '0', '0', 'police', 'rate', rate, 'burst', '256k',
+                       'drop', 'flowid', ':1'])
+    
+    def wait_for_handshake(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            result = subprocess.run(self.exec_command(['wg', 'show', self.interface, 'latest-handshakes']),
+                                    capture_output=True, text=True, check=False)
+            for line in result.stdout.splitlines():
+                fields = line.split()
+                if len(fields) == 2 and fields[1].isdigit() and int(fields[1]) > 0:
+                    return True
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        return False
+    
+    def exec_command(self, command: List[str]) -> List[str]:
+        return ['ip', 'netns', 'exec', self.namespace] + command
+    
+    def down(self):
+        subprocess.run(['ip', 'netns', 'del', self.namespace], capture_output=True, check=False)
+        subprocess.run(['ip', 'link', 'del', self.interface], capture_output=True, check=False)
+        shutil.rmtree(os.path.join('/etc/netns', self.namespace), ignore_errors=True)
+
+class ServerState:
+    PENDING = 'pending'
+    SWITCHING = 'switching-protocol'
+    CONNECTING = 'connecting'
+    VERIFYING = 'verifying'
+    MEASURING = 'measuring'
+    RECORDED = 'recorded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    
+    TERMINAL = frozenset([RECORDED, FAILED, CANCELLED])
+    TRANSITIONS = {
+        PENDING: frozenset([SWITCHING, CONNECTING, FAILED, CANCELLED]),
+        SWITCHING: frozenset([CONNECTING, FAILED, CANCELLED]),
+        CONNECTING: frozenset([CONNECTING, VERIFYING, FAILED, CANCELLED]),
+        VERIFYING: frozenset([CONNECTING, MEASURING, FAILED, CANCELLED]),
+        MEASURING: frozenset([RECORDED, FAILED, CANCELLED]),
+    }
+
+class ServerRun:
+    __slots__ = ('server', 'state', 'history', 'error')
+    
+    def __init__(self, server: Relay):
+        self.server = server
+        self.state = ServerState.PENDING
+        self.history = [(ServerState.PENDING, time.monotonic())]
+        self.error = None
+    
+    def advance(self, state: str):
+        if state not in ServerState.TRANSITIONS.get(self.state, ()):
+            raise RuntimeError(f"{self.server['server']}: invalid transition {self.state} -> {state}")
+        self.state = state
+        self.history.append((state, time.monotonic()))
+    
+    def fail(self, error: str):
+        self.error = error
+        self.advance(ServerState.FAILED)
+    
+    @property
+    def finished(self) -> bool:
+        return self.state in ServerState.TERMINAL
+    
+    def phase_durations(self) -> Dict[str, float]:
+        durations = {}
+        for (state, started), (_, ended) in zip(self.history, self.history[1:]):
+            durations[state] = durations.get(state, 0.0) + ended - started
+        return durations
+
+class RunBudget:
+    def __init__(self, seconds: float, measure_prior: float, connect_prior: float = 5.0):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.priors = {'connect': connect_prior, 'measure': measure_prior,
+                       'switch': PHASE_TIMEOUTS['protocol_settle'] + 0.5}
+        self.observed = {phase: [] for phase in self.priors}
+    
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+    
+    def observe(self, phase: str, seconds: float):
+        self.observed[phase].append(seconds)
+    
+    def estimate(self, phase: str) -> float:
+        return median(self.observed[phase]) or self.priors[phase]
+    
+    def plan(self, protocols: List[str], current_protocol: Optional[str], max_samples: int) -> Tuple[int, int]:
+        available = self.remaining()
+        connect, measure, switch = self.estimate('connect'), self.estimate('measure'), self.estimate('switch')
+        switches = [previous != protocol for previous, protocol in zip([current_protocol] + protocols, protocols)]
+        for samples in range(max_samples, 0, -1):
+            if len(protocols) * (connect + samples * measure) + sum(switches) * switch <= available:
+                return len(protocols), samples
+        
+        fit, spent = 0, 0.0
+        for needs_switch in switches:
+            spent += connect + measure + (switch if needs_switch else 0.0)
+            if spent > available:
+                break
+            fit += 1
+        if fit == 0 and not self.observed['measure'] and available > 0:
+            return 1, 1
+        return fit, 1
+
+PHASE_TIMEOUTS = {
+    'command': 15.0,
+    'protocol_settle': 2.0,
+    'retry_backoff': 2.0,
+    'measure': 180.0,
+}
+
+def run_async(coroutine):
+    if IS_WINDOWS and sys.version_info < (3, 8):
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    return asyncio.run(coroutine)
 
 class MullvadSpeedTester:
     def __init__(self):
         self.results = []
         self.original_server = None
         self.all_relays = []
+        self._catalog = None
+        self.tunnel_connected = False
+        self.connect_timeout = 20.0
+        self.traffic_probe = TRAFFIC_PROBE
+        self.last_connect_time = None
+        self.cache_ttl = DEFAULT_CACHE_TTL
+        self.cache_path = os.path.join(get_cache_dir(), 'relays.json')
+        self.relay_data_path = None
+        self.refresh_thread = None
+        self.screen_scores = {}
+        self.distances = {}
+        self.backend = None
+        self.backend_options = {'name': 'speedtest'}
+        self.measure_timeout = PHASE_TIMEOUTS['measure']
+        self.measure_duration = None
+        self.current_protocol = None
+        self.samples = 1
+        self.max_samples = 1
+        self.history = None
+        self.fixed_sleep_seconds = 0.0
+        self.budget = None
+        self.priority = {}
+        self.echo_target = None
+        self.echo_protocol = 'udp'
+        self.echo_rate = ECHO_RATE
+        self.sort_by = ['download']
+        self.score = None
+        self.pareto = False
+        self.top = None
+        self.pareto_metrics = []
+        self.server_runs = []
+        self.result_listeners = []
+        self._io_executor = None
         
     def check_requirements(self):
         print(f"{Colors.CYAN}Verifying system requirements...{Colors.END}")
         print(f"OS: {SYSTEM} {platform.version()[:30]}...")
         
-        try:
-            subprocess.run(['mullvad', 'version'], capture_output=True, check=True)
+        if probe_tool('mullvad', ['version']) is not None:
             print(f"{Colors.GREEN}✓ Mullvad CLI detected{Colors.END}")
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        else:
             print(f"{Colors.RED}✗ Mullvad CLI not found{Colors.END}")
             print(f"\nDownload from: https://mullvad.net/download")
             sys.exit(1)
         
-        try:
-            subprocess.run(['speedtest-cli', '--version'], capture_output=True, check=True)
+        if self.backend is None:
+            self.backend = make_backend('speedtest')
+        
+        if not isinstance(self.backend, (SpeedtestBackend, SpeedtestCliBackend)):
+            if not self.backend.check():
+                print(f"{Colors.RED}✗ {self.backend.name} backend not available{Colors.END}")
+                sys.exit(1)
+            print(f"{Colors.GREEN}✓ Measuring with {self.backend.describe()}{Colors.END}")
+            return
+        
+        if isinstance(self.backend, SpeedtestBackend):
+            print(f"{Colors.GREEN}✓ Speedtest engine ready{Colors.END}")
+            return
+        
+        if probe_tool('speedtest-cli', ['--version']) is not None:
             print(f"{Colors.GREEN}✓ Speedtest CLI ready{Colors.END}")
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        else:
             print(f"{Colors.YELLOW}Installing speedtest-cli...{Colors.END}")
             try:
                 if IS_WINDOWS:
@@ -91,103 +1912,330 @@ class MullvadSpeedTester:
                 print(f"{Colors.RED}Manual installation required: pip install speedtest-cli{Colors.END}")
                 sys.exit(1)
     
-    def get_all_relays(self) -> List[Dict]:
-        if self.all_relays:
-            return self.all_relays
+    @property
+    def catalog(self) -> RelayCatalog:
+        if self._catalog is None or self._catalog.relays is not self.all_relays:
+            self._catalog = RelayCatalog(self.all_relays)
+        return self._catalog
+    
+    def parse_relay_list(self, output: str) -> List[Relay]:
+        relays = []
+        current_country = None
+        current_city = None
+        position = (None, None)
+        
+        for line in output.split('\n'):
+            if not line.strip():
+                continue
             
-        try:
-            result = subprocess.run(['mullvad', 'relay', 'list'], 
-                                  capture_output=True, text=True, check=True)
+            tab_count = len(line) - len(line.lstrip('\t'))
+            line_stripped = line.strip()
             
-            relays = []
-            current_country = None
-            current_city = None
+            if '(' not in line_stripped:
+                continue
             
-            for line in result.stdout.split('\n'):
-                if not line.strip():
-                    continue
-                
-                tab_count = len(line) - len(line.lstrip('\t'))
-                line_stripped = line.strip()
-                
-                if '(' not in line_stripped:
-                    continue
-                
-                name = line_stripped.split('(')[0].strip()
-                
-                if tab_count == 0:
-                    current_country = name
-                    current_city = None
-                elif tab_count == 1:
-                    current_city = name
-                elif tab_count == 2 and current_country and current_city:
-                    server = {
-                        'country': current_country,
-                        'city': current_city,
-                        'server': name,
-                        'provider': 'wireguard' if 'wg' in name else 'openvpn'
-                    }
-                    relays.append(server)
-            
-            self.all_relays = relays
-            return relays
+            name = line_stripped.split('(')[0].strip()
             
-        except subprocess.CalledProcessError:
-            return []
+            if tab_count == 0:
+                current_country = name
+                current_city = None
+            elif tab_count == 1:
+                current_city = name
+                coordinates = re.findall(r'-?\d+(?:\.\d+)?', line_stripped.partition('@')[2])
+                position = (float(coordinates[0]), float(coordinates[1])) if len(coordinates) >= 2 else (None, None)
+            elif tab_count == 2 and current_country and current_city:
+                addresses, _, details = line_stripped.split('(', 1)[1].partition(')')
+                addresses = [a.strip() for a in addresses.split(',')]
+                ipv4 = next((a for a in addresses if a.count('.') == 3), None)
+                ipv6 = next((a for a in addresses if ':' in a), None)
+                label, _, hosting = details.lstrip(' -').partition(', hosted by ')
+                protocol = label.strip().lower()
+                if protocol not in ('wireguard', 'openvpn'):
+                    protocol = 'wireguard' if 'wg' in name else 'openvpn'
+                hoster, _, ownership = hosting.partition(' (')
+                relays.append(Relay(current_country, current_city, name, protocol, ipv4, ipv6,
+                                    ownership.startswith('Mullvad-owned') if ownership else None, hoster or None,
+                                    latitude=position[0], longitude=position[1]))
+        
+        return relays
+    
+    def fetch_relays(self) -> Optional[List[Relay]]:
+        relays = load_relay_data(self.relay_data_path)
+        if relays is None:
+            try:
+                result = subprocess.run(['mullvad', 'relay', 'list'], 
+                                      capture_output=True, text=True, check=True)
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                return None
+            relays = self.parse_relay_list(result.stdout)
+        
+        return [relay for relay in relays if relay.active is not False]
+    
+    def load_relay_cache(self) -> Tuple[Optional[List[Relay]], Optional[float]]:
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        
+        if not isinstance(cache, dict) or cache.get('version') != RELAY_CACHE_VERSION:
+            return None, None
+        if not cache.get('relays'):
+            return None, None
+        
+        relays = [Relay.from_dict(relay) for relay in cache['relays']]
+        return relays, time.time() - cache.get('fetched_at', 0)
+    
+    def save_relay_cache(self, relays: List[Relay]):
+        try:
+            write_json_atomic(self.cache_path, {
+                'version': RELAY_CACHE_VERSION,
+                'fetched_at': time.time(),
+                'relays': [relay.to_dict() for relay in relays]
+            })
+        except OSError:
+            pass
+    
+    def refresh_relays_in_background(self):
+        if self.refresh_thread and self.refresh_thread.is_alive():
+            return
+        
+        def refresh():
+            relays = self.fetch_relays()
+            if relays:
+                self.save_relay_cache(relays)
+        
+        if self.refresh_thread is None:
+            atexit.register(self.wait_for_background_refresh)
+        self.refresh_thread = threading.Thread(target=refresh, daemon=True)
+        self.refresh_thread.start()
     
-    def filter_relays(self, country: str = None, city: str = None, provider: str = None) -> List[Dict]:
-        relays = self.get_all_relays()
+    def wait_for_background_refresh(self, timeout: float = 15.0):
+        if self.refresh_thread and self.refresh_thread.is_alive():
+            self.refresh_thread.join(timeout)
+    
+    def get_all_relays(self, force_refresh: bool = False) -> List[Relay]:
+        if self.all_relays and not force_refresh:
+            return self.all_relays
         
-        if country:
-            relays = [r for r in relays if country.lower() in r['country'].lower()]
-        if city:
-            relays = [r for r in relays if city.lower() in r['city'].lower()]
-        if provider:
-            relays = [r for r in relays if r['provider'] == provider.lower()]
+        if not force_refresh and not self.relay_data_path:
+            cached, age = self.load_relay_cache()
+            if cached:
+                self.all_relays = cached
+                if age > self.cache_ttl:
+                    self.refresh_relays_in_background()
+                return cached
         
+        relays = self.fetch_relays()
+        if relays is None:
+            return self.all_relays
+        
+        if relays and not self.relay_data_path:
+            self.save_relay_cache(relays)
+        self.all_relays = relays
         return relays
     
+    def order_by_history(self, relays: List[Relay]) -> List[Relay]:
+        if self.history is None:
+            return relays
+        scores = self.history.strength()
+        known = sorted((relay for relay in relays if relay['server'] in scores),
+                       key=lambda relay: scores[relay['server']], reverse=True)
+        if known:
+            print(f"{Colors.CYAN}Testing {len(known)} relays with the strongest history first{Colors.END}\n")
+        if self.budget:
+            self.priority = {relay['server']: -scores.get(relay['server'], float('-inf')) for relay in relays}
+        return known + [relay for relay in relays if relay['server'] not in scores]
+    
+    def filter_relays(self, country: Union[str, List[str]] = None, city: Union[str, List[str]] = None,
+                      provider: str = None) -> List[Relay]:
+        self.get_all_relays()
+        return self.catalog.filter(country=country, city=city, provider=provider)
+    
+    def select_relays(self, countries: Optional[List[str]] = None, cities: Optional[List[str]] = None,
+                      regions: Optional[List[str]] = None, provider: Optional[str] = None) -> List[Relay]:
+        countries = list(countries or [])
+        for region in regions or []:
+            countries.extend(name for name in REGIONS[region] if name in self.catalog.locations)
+        if regions and not countries:
+            return []
+        return self.filter_relays(country=countries or None, city=cities or None, provider=provider)
+    
+    def plan_sweep(self, relays: List[Relay]) -> List[Relay]:
+        if not self.priority:
+            return self._group_sweep(relays, self.current_protocol)
+        ranks = [self.priority.get(relay['server'], float('inf')) for relay in relays]
+        plan = []
+        start = 0
+        for end in range(1, len(relays) + 1):
+            if end == len(relays) or ranks[end] != ranks[start]:
+                plan.extend(self._group_sweep(relays[start:end], plan[-1]['provider'] if plan else self.current_protocol))
+                start = end
+        return plan
+    
+    def _group_sweep(self, relays: List[Relay], current_protocol: Optional[str]) -> List[Relay]:
+        protocols = []
+        if current_protocol:
+            protocols.append(current_protocol)
+        protocols.extend(protocol for protocol in ('wireguard', 'openvpn') if protocol not in protocols)
+        protocols.extend(relay['provider'] for relay in relays if relay['provider'] not in protocols)
+        
+        connected = self.original_server if self.tunnel_connected else None
+        plan = []
+        for protocol in sorted(protocols, key=lambda protocol: not any(
+                relay['server'] == connected and relay['provider'] == protocol for relay in relays)):
+            locations = {}
+            for relay in relays:
+                if relay['provider'] == protocol:
+                    locations.setdefault((relay['country'], relay['city']), []).append(relay)
+            for group in locations.values():
+                group.sort(key=lambda relay: relay['server'] != connected)
+            ordered = sorted(locations.values(), key=lambda group: group[0]['server'] != connected)
+            plan.extend(relay for group in ordered for relay in group)
+        return plan
+    
     def get_countries(self) -> List[str]:
-        countries = []
-        seen = set()
-        for relay in self.all_relays:
-            if relay['country'] not in seen:
-                countries.append(relay['country'])
-                seen.add(relay['country'])
-        return sorted(countries)
+        return list(self.catalog.countries)
     
     def get_cities(self, country: str) -> List[tuple]:
-        cities = {}
-        for relay in self.all_relays:
-            if relay['country'] == country:
-                city = relay['city']
-                if city not in cities:
-                    cities[city] = 0
-                cities[city] += 1
-        return sorted([(city, count) for city, count in cities.items()])
+        return list(self.catalog.cities.get(country, []))
+    
+    def _parse_connected_server(self, status_output: str) -> Optional[str]:
+        if 'Connected to' in status_output:
+            parts = status_output.split('Connected to')
+            if len(parts) > 1:
+                server_part = parts[1].strip()
+                return server_part.split()[0] if server_part else None
+        
+        for line in status_output.split('\n'):
+            if 'Relay:' in line:
+                parts = line.split('Relay:')
+                if len(parts) > 1:
+                    return parts[1].strip().split()[0]
+        
+        return None
     
     def get_connected_server(self) -> Optional[str]:
         try:
             result = subprocess.run(['mullvad', 'status'], 
                                   capture_output=True, text=True, check=True)
-            
-            if 'Connected to' in result.stdout:
-                parts = result.stdout.split('Connected to')
-                if len(parts) > 1:
-                    server_part = parts[1].strip()
-                    return server_part.split()[0] if server_part else None
-            
-            for line in result.stdout.split('\n'):
-                if 'Relay:' in line:
-                    parts = line.split('Relay:')
-                    if len(parts) > 1:
-                        return parts[1].strip().split()[0]
-            
-            return None
+            return self._parse_connected_server(result.stdout)
         except:
             return None
     
+    def _icmp_rtt(self, address: str, timeout: float) -> Optional[float]:
+        if IS_WINDOWS:
+            command = ['ping', '-n', '1', '-w', str(int(timeout * 1000)), address]
+        elif IS_MACOS:
+            command = ['ping', '-c', '1', '-t', str(max(1, int(timeout))), address]
+        else:
+            command = ['ping', '-c', '1', '-W', str(max(1, int(timeout))), address]
+        
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout + 2)
+        except (subprocess.TimeoutExpired, OSError):
+            return None
+        
+        match = re.search(r'time[=<]\s*([\d.]+)\s*ms', result.stdout)
+        return float(match.group(1)) if match else None
+    
+    def probe_relay_rtt(self, relay: Relay, method: str = 'tcp', samples: int = 3,
+                        timeout: float = 1.0, port: int = SCREEN_PORT) -> Optional[float]:
+        rtts = []
+        for _ in range(samples):
+            if method == 'icmp':
+                rtt = self._icmp_rtt(relay.ipv4, timeout)
+            elif method == 'udp':
+                rtt = udp_echo_rtt(relay.ipv4, ECHO_PORT, timeout)
+            else:
+                rtt = tcp_connect_rtt(relay.ipv4, port, timeout)
+            if rtt is not None:
+                rtts.append(rtt)
+        return min(rtts) if rtts else None
+    
+    def screen_relays(self, relays: List[Relay], top_k: int, method: str = 'tcp',
+                      concurrency: int = 64) -> List[Relay]:
+        candidates = [r for r in relays if r.get('ipv4')]
+        if not candidates:
+            print(f"{Colors.YELLOW}No relay addresses known, skipping pre-screen (try --refresh){Colors.END}")
+            return relays[:top_k]
+        
+        if self.tunnel_connected:
+            subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
+            self.tunnel_connected = False
+        
+        print(f"{Colors.CYAN}Pre-screening {len(candidates)} relays by {method.upper()} latency...{Colors.END}", end='', flush=True)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(candidates)))) as pool:
+            rtts = list(pool.map(lambda relay: self.probe_relay_rtt(relay, method), candidates))
+        print(f" {Colors.GREEN}✓{Colors.END} ({time.monotonic() - started:.1f}s)")
+        
+        for relay, rtt in zip(candidates, rtts):
+            self.screen_scores[relay['server']] = rtt
+        
+        reachable = sorted((rtt, i) for i, rtt in enumerate(rtts) if rtt is not None)
+        if not reachable:
+            print(f"{Colors.YELLOW}No relay answered the pre-screen, keeping list order{Colors.END}")
+            return relays[:top_k]
+        
+        ranked = [candidates[i] for _, i in reachable]
+        ranked += [r for r, rtt in zip(candidates, rtts) if rtt is None]
+        ranked += [r for r in relays if not r.get('ipv4')]
+        selected = ranked[:top_k]
+        
+        print(f"Selected {len(selected)} of {len(relays)} relays "
+              f"(RTT {reachable[0][0]:.1f}-{reachable[min(top_k, len(reachable)) - 1][0]:.1f} ms, "
+              f"{len(candidates) - len(reachable)} unreachable)")
+        print()
+        return selected
+    
+    def resolve_location(self, value: Optional[str]) -> Optional[Tuple[float, float, str]]:
+        if value and value != 'auto':
+            latitude, sep, longitude = value.partition(',')
+            try:
+                if sep:
+                    return float(latitude), float(longitude), f"{float(latitude):.2f}, {float(longitude):.2f}"
+            except ValueError:
+                pass
+            for city in sorted(self.catalog.match_cities(value)):
+                relay = next((r for r in self.catalog.relays if r.city == city and r.latitude is not None), None)
+                if relay:
+                    return relay.latitude, relay.longitude, f"{relay.city}, {relay.country}"
+            return None
+        
+        if self.tunnel_connected:
+            subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
+            self.tunnel_connected = False
+        print(f"{Colors.CYAN}Estimating your location...{Colors.END}", end='', flush=True)
+        estimate = estimate_client_location()
+        if estimate is None:
+            print(f" {Colors.RED}✗{Colors.END}")
+            return None
+        place = ', '.join(part for part in (estimate.get('city'), estimate.get('country')) if part) or 'unknown'
+        print(f" {Colors.GREEN}✓{Colors.END} ({place})")
+        return estimate['latitude'], estimate['longitude'], place
+    
+    def select_nearest(self, relays: List[Relay], count: int, latitude: float, longitude: float) -> List[Relay]:
+        load_numpy()
+        started = time.perf_counter()
+        ranked = self.catalog.nearest(latitude, longitude, count, relays)
+        if not ranked:
+            print(f"{Colors.YELLOW}No relay coordinates known, keeping list order (try --refresh){Colors.END}")
+            return relays[:count]
+        
+        for relay, distance in ranked:
+            self.distances[relay.server] = round(distance, 1)
+        self.priority = dict(self.distances)
+        print(f"Selected the {len(ranked)} nearest of {len(relays)} relays "
+              f"({ranked[0][1]:.0f}-{ranked[-1][1]:.0f} km, ranked in "
+              f"{(time.perf_counter() - started) * 1000:.1f} ms{'' if load_numpy() else ' without NumPy'})")
+        print()
+        return [relay for relay, _ in ranked]
+    
     def test_servers(self, relays: List[Dict], limit: int = None, specific_servers: List[Dict] = None):
+        run_async(self.test_servers_async(relays, limit=limit, specific_servers=specific_servers))
+    
+    async def test_servers_async(self, relays: List[Dict], limit: int = None, specific_servers: List[Dict] = None):
         if specific_servers:
             servers_to_test = specific_servers
         else:
@@ -202,7 +2250,14 @@ class MullvadSpeedTester:
         wg_servers = [s for s in servers_to_test if s['provider'] == 'wireguard']
         ovpn_servers = [s for s in servers_to_test if s['provider'] == 'openvpn']
         
-        location = f"{servers_to_test[0]['city']}, {servers_to_test[0]['country']}"
+        plan = self.plan_sweep(servers_to_test)
+        locations = list(dict.fromkeys((s['city'], s['country']) for s in plan))
+        switches = sum(1 for previous, current in zip([self.current_protocol] + [s['provider'] for s in plan],
+                                                      [s['provider'] for s in plan]) if previous != current)
+        if len(locations) == 1:
+            location = f"{locations[0][0]}, {locations[0][1]}"
+        else:
+            location = f"{len(locations)} locations"
         
         print(f"\n{Colors.BOLD}Testing servers in {location}{Colors.END}")
         print(f"Total available servers: {total}")
@@ -218,159 +2273,692 @@ class MullvadSpeedTester:
         elif ovpn_servers:
             print(f"Protocol breakdown:")
             print(f"  OpenVPN: {len(ovpn_servers)} servers")
+        if len(locations) > 1:
+            print(f"Plan: {len(locations)} locations, {switches} protocol switch{'es' if switches != 1 else ''}")
         
         print()
         
+        loop = asyncio.get_event_loop()
+        runs = [ServerRun(server) for server in plan]
+        self.server_runs = runs
+        pending_io = []
         tested_servers = set()
-        current_protocol = None
-        server_num = 0
-        
-        if wg_servers:
-            print(f"{Colors.BLUE}→ Switching to WireGuard protocol{Colors.END}")
-            subprocess.run(['mullvad', 'relay', 'set', 'tunnel-protocol', 'wireguard'],
-                         capture_output=True, check=False)
-            time.sleep(2)
-            current_protocol = 'wireguard'
-            print()
-            
-            for server in wg_servers:
-                server_num += 1
+        liveness = {}
+        
+        def probe_next(index: int):
+            following = runs[index + 1].server if index + 1 < len(runs) else None
+            if following is not None and following.get('ipv4') and index + 1 not in liveness:
+                liveness[index + 1] = loop.run_in_executor(None, relay_unreachable, following['ipv4'], SCREEN_PORT)
+        
+        try:
+            for index, run in enumerate(runs):
+                server = run.server
                 server_name = server['server']
                 
                 if server_name in tested_servers:
+                    run.fail('duplicate')
                     continue
                 
-                print(f"[{server_num}/{total}] Testing {server_name} (WireGuard)")
+                if self.budget:
+                    fit, samples = self.budget.plan([r.server['provider'] for r in runs[index:]],
+                                                    self.current_protocol, self.max_samples)
+                    if fit == 0:
+                        for remaining in runs[index:]:
+                            remaining.advance(ServerState.CANCELLED)
+                        print(f"{Colors.YELLOW}⏱ Time budget reached: {len(runs) - index} "
+                              f"relay{'s' if len(runs) - index != 1 else ''} not tested{Colors.END}\n")
+                        break
+                    self.samples = samples
+                    print(f"{Colors.CYAN}⏱ {self.budget.remaining():.0f}s left: ~{fit} relay{'s' if fit != 1 else ''} "
+                          f"× {samples} sample{'s' if samples != 1 else ''}{Colors.END}")
+                
+                await self._ensure_protocol(run)
                 
-                if self.connect_to_specific_server(server_name):
-                    metrics = self.run_speed_test()
-                    if metrics:
-                        result = {
-                            'server': server_name,
-                            'country': server['country'],
-                            'city': server['city'],
-                            'provider': 'WireGuard',
-                            'ping': metrics['ping'],
-                            'download': metrics['download'],
-                            'upload': metrics['upload'],
-                            'timestamp': datetime.now().isoformat()
-                        }
-                        self.results.append(result)
-                        tested_servers.add(server_name)
-                        
-                        print(f"    {Colors.GREEN}Download: {metrics['download']:.2f} Mbps | "
-                              f"Upload: {metrics['upload']:.2f} Mbps | "
-                              f"Ping: {metrics['ping']:.2f} ms{Colors.END}")
+                label = 'WireGuard' if server['provider'] == 'wireguard' else 'OpenVPN'
+                print(f"[{index + 1}/{total}] Testing {server_name} ({label})")
+                
+                result = await self._test_server_async(run, label, liveness.pop(index, None),
+                                                       lambda: probe_next(index))
+                if result:
+                    tested_servers.add(server_name)
+                    pending_io.append(asyncio.ensure_future(self._record_result_async(result)))
                 print()
         
-        if ovpn_servers:
-            if current_protocol != 'openvpn':
-                print(f"{Colors.BLUE}→ Switching to OpenVPN protocol{Colors.END}")
-                subprocess.run(['mullvad', 'relay', 'set', 'tunnel-protocol', 'openvpn'],
-                             capture_output=True, check=False)
-                time.sleep(2)
-                print()
+        except asyncio.CancelledError:
+            for run in runs:
+                if not run.finished:
+                    run.advance(ServerState.CANCELLED)
+            raise
+        
+        finally:
+            if pending_io:
+                await asyncio.gather(*pending_io, return_exceptions=True)
+        
+        print(f"{Colors.GREEN}✓ Testing complete!{Colors.END}")
+        
+        connect_times = [r['connect_time'] for r in self.results if r.get('connect_time') is not None]
+        if connect_times:
+            print(f"Average connect-to-ready time: {sum(connect_times) / len(connect_times):.1f}s "
+                  f"(fastest {min(connect_times):.1f}s, slowest {max(connect_times):.1f}s)")
+    
+    def estimate_minutes(self, relays: int) -> int:
+        measure = self.backend.expected_seconds(self.measure_duration) if self.backend else 30.0
+        per_relay = self.connect_timeout / 4 + measure * self.samples
+        return max(1, round(relays * per_relay / 60))
+    
+    async def _pause(self, phase: str):
+        seconds = PHASE_TIMEOUTS[phase]
+        self.fixed_sleep_seconds += seconds
+        with TRACER.span('sleep.' + phase):
+            await asyncio.sleep(seconds)
+    
+    async def _ensure_protocol(self, run: ServerRun):
+        protocol = run.server['provider']
+        if protocol == self.current_protocol:
+            return
+        
+        run.advance(ServerState.SWITCHING)
+        label = 'WireGuard' if protocol == 'wireguard' else 'OpenVPN'
+        print(f"{Colors.BLUE}→ Switching to {label} protocol{Colors.END}")
+        started = time.monotonic()
+        with TRACER.span('protocol_switch', protocol=protocol):
+            await self._daemon_command('relay', 'set', 'tunnel-protocol', protocol)
+            await self._pause('protocol_settle')
+        if self.budget:
+            self.budget.observe('switch', time.monotonic() - started)
+        self.current_protocol = protocol
+        print()
+    
+    def find_best(self, relays: List[Relay], budget: float = 300.0, initial_duration: float = 3.0,
+                  max_rounds: int = 5):
+        run_async(self.find_best_async(relays, budget, initial_duration, max_rounds))
+    
+    def _leader_separated(self, ranked: List[Dict]) -> bool:
+        if len(ranked) < 2:
+            return len(ranked) == 1
+        _, leader_low, _ = mean_confidence_interval(ranked[0]['samples'])
+        _, _, runner_up_high = mean_confidence_interval(ranked[1]['samples'])
+        return leader_low is not None and runner_up_high is not None and leader_low > runner_up_high
+    
+    async def find_best_async(self, relays: List[Relay], budget: float = 300.0, initial_duration: float = 3.0,
+                              max_rounds: int = 5):
+        unique = list({relay['server']: relay for relay in relays}.values())
+        if not unique:
+            print(f"{Colors.RED}No servers to test{Colors.END}")
+            return
+        
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + budget
+        arms = {relay['server']: {'relay': relay, 'pulls': [], 'samples': [], 'round': 0} for relay in unique}
+        survivors = unique
+        duration = initial_duration
+        separated = False
+        out_of_time = False
+        rounds = 0
+        connect_costs = []
+        
+        print(f"\n{Colors.BOLD}Finding the fastest of {len(unique)} relays (budget {budget:.0f}s){Colors.END}")
+        
+        try:
+            while survivors and rounds < max_rounds:
+                if loop.time() + duration * 2 > deadline:
+                    out_of_time = True
+                    break
+                rounds += 1
+                self.measure_duration = duration
+                ordered = sorted(survivors, key=lambda relay: relay['provider'] != 'wireguard')
+                print(f"\n{Colors.CYAN}Round {rounds}: {len(ordered)} relays, {duration:.0f}s per direction{Colors.END}\n")
+                
+                for relay in ordered:
+                    connect_cost = sum(connect_costs) / len(connect_costs) if connect_costs else self.connect_timeout / 2
+                    if loop.time() + connect_cost + duration * 2 > deadline:
+                        out_of_time = True
+                        break
+                    
+                    run = ServerRun(relay)
+                    self.server_runs.append(run)
+                    await self._ensure_protocol(run)
+                    label = 'WireGuard' if relay['provider'] == 'wireguard' else 'OpenVPN'
+                    print(f"  {relay['server']} ({label})")
+                    result = await self._test_server_async(run, label)
+                    if self.last_connect_time is not None:
+                        connect_costs.append(self.last_connect_time)
+                    if result:
+                        arm = arms[relay['server']]
+                        arm['pulls'].append(result)
+                        arm['samples'].append(result['download'])
+                        arm['round'] = rounds
+                
+                ranked = sorted((arms[relay['server']] for relay in survivors if arms[relay['server']]['samples']),
+                                key=lambda arm: median(arm['samples']), reverse=True)
+                separated = self._leader_separated(ranked)
+                if separated or out_of_time or len(ranked) <= 1:
+                    break
+                
+                survivors = [arm['relay'] for arm in ranked[:max(2, (len(ranked) + 1) // 2)]]
+                duration *= 2
+        
+        finally:
+            self.measure_duration = None
+            for arm in arms.values():
+                if arm['pulls']:
+                    self.record_result(self._aggregate_pulls(arm, rounds))
+        
+        ranked = sorted((arm for arm in arms.values() if arm['samples']),
+                        key=lambda arm: median(arm['samples']), reverse=True)
+        print()
+        if not ranked:
+            print(f"{Colors.RED}No relay could be measured{Colors.END}")
+        elif separated:
+            print(f"{Colors.GREEN}✓ {ranked[0]['relay']['server']} leads at 95% confidence after {rounds} rounds{Colors.END}")
+        else:
+            reason = 'time budget used up' if out_of_time else 'round limit reached'
+            print(f"{Colors.YELLOW}Leader not statistically separated ({reason}), ranking by median{Colors.END}")
+    
+    def _aggregate_pulls(self, arm: Dict, rounds: int) -> Dict:
+        pulls = arm['pulls']
+        result = dict(self._combine_samples(pulls))
+        result['rounds'] = arm['round']
+        result['eliminated'] = arm['round'] < rounds
+        return result
+    
+    async def _test_server_async(self, run: ServerRun, label: str, liveness=None,
+                                 on_measuring=None) -> Optional[Dict]:
+        server = run.server
+        max_retries = 3
+        if liveness is not None and await liveness:
+            print(f"    {Colors.YELLOW}No TCP answer from {server['ipv4']} in {LIVENESS_ATTEMPTS} tries; "
+                  f"trying the tunnel once{Colors.END}")
+            max_retries = 1
+        
+        started = time.monotonic()
+        run.advance(ServerState.CONNECTING)
+        try:
+            connected = await asyncio.wait_for(self.connect_async(server['server'], max_retries, run),
+                                               self.budget.remaining() if self.budget else None)
+        except asyncio.TimeoutError:
+            print(f" {Colors.YELLOW}⏱ Time budget reached{Colors.END}")
+            run.fail('budget')
+            return None
+        if not connected:
+            run.fail('connect')
+            return None
+        if self.budget:
+            self.budget.observe('connect', time.monotonic() - started)
+        
+        run.advance(ServerState.MEASURING)
+        if on_measuring is not None:
+            on_measuring()
+        loop = asyncio.get_event_loop()
+        taken = []
+        while len(taken) < self._samples_wanted(taken):
+            timeout = self.measure_timeout
+            if self.budget:
+                timeout = min(timeout, max(1.0, self.budget.remaining()))
+            started = time.monotonic()
+            try:
+                metrics = await asyncio.wait_for(
+                    loop.run_in_executor(None, self.run_speed_test, server['city']), timeout)
+            except asyncio.TimeoutError:
+                if self.backend:
+                    self.backend.cancel()
+                print(f" {Colors.RED}✗ Timeout{Colors.END}")
+                metrics = None
+            except asyncio.CancelledError:
+                if self.backend:
+                    self.backend.cancel()
+                raise
             
-            for server in ovpn_servers:
-                server_num += 1
-                server_name = server['server']
+            if not metrics:
+                break
+            if self.budget:
+                self.budget.observe('measure', time.monotonic() - started)
+            taken.append(metrics)
+            print(f"    {Colors.GREEN}Download: {metrics['download']:.2f} Mbps | "
+                  f"Upload: {metrics['upload']:.2f} Mbps | "
+                  f"Ping: {metrics['ping']:.2f} ms{Colors.END}")
+        
+        if not taken:
+            run.fail('measure')
+            return None
+        
+        run.advance(ServerState.RECORDED)
+        metrics = self._combine_samples(taken)
+        if len(taken) > 1:
+            stats = metrics['stats']['download']
+            print(f"    {Colors.GREEN}Median of {len(taken)}: {metrics['download']:.2f} Mbps "
+                  f"(p10 {stats['p10']:.2f}, p90 {stats['p90']:.2f}){Colors.END}")
+        return self._build_result(server, label, metrics)
+    
+    def _samples_wanted(self, taken: List[Dict]) -> int:
+        if taken and self.budget and self.budget.remaining() < self.budget.estimate('measure'):
+            return len(taken)
+        if len(taken) < self.samples or len(taken) >= self.max_samples:
+            return self.samples
+        if len(taken) == 1:
+            return 1 if self.budget else 2
+        downloads = [metrics['download'] for metrics in taken]
+        stats = summarize_samples(downloads)
+        if stats['mean'] > 0 and stats['stddev'] / stats['mean'] > SAMPLE_CV_LIMIT:
+            return len(taken) + 1
+        return len(taken)
+    
+    def _combine_samples(self, taken: List[Dict]) -> Dict:
+        if len(taken) == 1:
+            return taken[0]
+        combined = dict(taken[-1])
+        combined['samples'] = {key: [round(metrics[key], 2) for metrics in taken]
+                               for key in ('download', 'upload', 'ping')}
+        combined['stats'] = {key: summarize_samples(values) for key, values in combined['samples'].items()}
+        for key in ('download', 'upload', 'ping'):
+            combined[key] = combined['stats'][key]['median']
+        for key in LOAD_KEYS:
+            values = [metrics[key] for metrics in taken if metrics.get(key) is not None]
+            if values:
+                combined[key] = round(median(values), 2)
+        return combined
+    
+    def _notify_result_listeners(self, result: Dict):
+        for listener in self.result_listeners:
+            listener(result)
+    
+    def record_result(self, result: Dict):
+        self.results.append(result)
+        self._notify_result_listeners(result)
+    
+    async def _record_result_async(self, result: Dict):
+        self.results.append(result)
+        await self._publish_result_async(result)
+    
+    async def _publish_result_async(self, result: Dict):
+        if not self.result_listeners:
+            return
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=1)
+        await asyncio.get_event_loop().run_in_executor(self._io_executor, self._notify_result_listeners, result)
+    
+    async def _run_async(self, *command: str, timeout: Optional[float] = None,
+                         protect: bool = False) -> Tuple[int, str]:
+        if protect:
+            isolation = ({'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if IS_WINDOWS
+                         else {'start_new_session': True})
+        else:
+            isolation = {}
+        
+        proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.DEVNULL, **isolation)
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        return proc.returncode, stdout.decode(errors='replace')
+    
+    async def _daemon_command(self, *args: str, timeout: float = PHASE_TIMEOUTS['command']) -> Tuple[int, str]:
+        task = asyncio.ensure_future(self._run_async('mullvad', *args, timeout=timeout, protect=True))
+        with TRACER.span('mullvad.' + ' '.join(args[:3])):
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    try:
+                        await task
+                    except Exception:
+                        pass
+                raise
+    
+    async def _start_status_listener(self) -> Optional[asyncio.subprocess.Process]:
+        try:
+            return await asyncio.create_subprocess_exec('mullvad', 'status', 'listen',
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return None
+    
+    async def _stop_status_listener(self, proc: Optional[asyncio.subprocess.Process]):
+        if proc is None or proc.returncode is not None:
+            return
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), 1)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+    
+    async def _is_connected_to(self, server_hostname: str) -> bool:
+        try:
+            with TRACER.span('mullvad.status'):
+                returncode, stdout = await self._run_async('mullvad', 'status', timeout=PHASE_TIMEOUTS['command'])
+        except (OSError, asyncio.TimeoutError):
+            return False
+        
+        if returncode != 0 or 'Connected' not in stdout:
+            return False
+        
+        connected = self._parse_connected_server(stdout)
+        return connected is None or connected == server_hostname
+    
+    async def wait_for_tunnel(self, server_hostname: str, listener: Optional[asyncio.subprocess.Process],
+                              timeout: float) -> bool:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        stream = listener.stdout if listener else None
+        delay = 0.1
+        
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            
+            wait = min(delay, remaining)
+            if stream is not None:
+                try:
+                    line = await asyncio.wait_for(stream.readline(), wait)
+                except asyncio.TimeoutError:
+                    line = None
                 
-                if server_name in tested_servers:
+                if line == b'':
+                    stream = None
+                elif line is not None and b'Connected' not in line:
                     continue
+            else:
+                await asyncio.sleep(wait)
+            
+            if await self._is_connected_to(server_hostname):
+                return True
+            
+            delay = min(delay * 2, 1.0)
+    
+    async def tunnel_carries_traffic_async(self, timeout: float) -> bool:
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        delay = 0.1
+        
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(*self.traffic_probe),
+                                                   min(2.0, remaining))
+                writer.close()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                pass
+            
+            await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+            delay = min(delay * 2, 1.0)
+    
+    def tunnel_carries_traffic(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            try:
+                with socket.create_connection(self.traffic_probe, timeout=min(2.0, remaining)):
+                    return True
+            except OSError:
+                pass
+            
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 1.0)
+    
+    def _measure_worker_command(self) -> List[str]:
+        options = self.backend_options
+        command = [sys.executable, os.path.abspath(__file__), '--measure-worker',
+                   '--backend', options.get('name', 'speedtest'),
+                   '--test-duration', str(options.get('duration', 10.0)),
+                   '--probe-host', f"{self.traffic_probe[0]}:{self.traffic_probe[1]}",
+                   '--connect-timeout', str(self.connect_timeout)]
+        if options.get('target'):
+            command += ['--target', str(options['target'])]
+        if options.get('upload_url'):
+            command += ['--upload-url', options['upload_url']]
+        if options.get('streams', 1) > 1:
+            command += ['--streams', str(options['streams'])]
+        if self.echo_target:
+            command += ['--echo-target', f"{self.echo_target[0]}:{self.echo_target[1]}",
+                        '--echo-protocol', self.echo_protocol, '--echo-rate', str(self.echo_rate)]
+        return command
+    
+    def test_servers_parallel(self, relays: List[Relay], limit: int = None, concurrency: int = 4,
+                              bandwidth_mbit: Optional[float] = None, device: Optional[Dict] = None,
+                              peers: Optional[Dict[str, Dict]] = None):
+        servers_to_test = relays[:limit] if limit else relays
+        if not servers_to_test:
+            print(f"{Colors.RED}No servers to test{Colors.END}")
+            return
+        
+        if not IS_LINUX or os.geteuid() != 0:
+            print(f"{Colors.RED}Parallel testing needs Linux and root (network namespaces){Colors.END}")
+            return
+        
+        device = device or load_device_wireguard_config()
+        if not device:
+            print(f"{Colors.RED}No WireGuard device key found (is this device logged in to Mullvad?){Colors.END}")
+            return
+        
+        peers = peers if peers is not None else load_relay_wireguard_peers()
+        wg_servers = [s for s in servers_to_test if s['provider'] == 'wireguard' and s['server'] in peers]
+        other_servers = [s for s in servers_to_test if s not in wg_servers]
+        
+        if self.tunnel_connected:
+            subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
+            self.tunnel_connected = False
+        
+        concurrency = max(1, min(concurrency, len(wg_servers) or 1))
+        rate_mbit = bandwidth_mbit / concurrency if bandwidth_mbit else None
+        total = len(wg_servers)
+        
+        print(f"\n{Colors.BOLD}Testing {total} WireGuard servers, {concurrency} tunnels in parallel{Colors.END}")
+        if rate_mbit:
+            print(f"Bandwidth per tunnel: {rate_mbit:.1f} Mbit/s")
+        print()
+        
+        key_fd, key_file = tempfile.mkstemp(prefix='tbi-wg-')
+        with os.fdopen(key_fd, 'w') as f:
+            f.write(device['private_key'] + '\n')
+        
+        slots = queue.Queue()
+        for slot in range(concurrency):
+            slots.put(slot)
+        lock = threading.Lock()
+        finished = [0]
+        worker_command = self._measure_worker_command()
+        worker_timeout = self.backend_options.get('duration', 10.0) * 2 + self.connect_timeout + 120
+        
+        def report(server: Relay, message: str):
+            with lock:
+                finished[0] += 1
+                print(f"[{finished[0]}/{total}] {server['server']:<20} {message}")
+        
+        def run(server: Relay):
+            slot = slots.get()
+            peer = peers[server['server']]
+            address = peer.get('ipv4') or server.get('ipv4')
+            tunnel = NamespaceTunnel(slot, key_file, device['addresses'], peer['public_key'],
+                                     f"{address}:{WIREGUARD_PORT}", rate_mbit=rate_mbit)
+            started = time.monotonic()
+            try:
+                with TRACER.span('netns.up', relay=server['server']):
+                    tunnel.up()
+                with TRACER.span('netns.handshake', relay=server['server']):
+                    handshake = tunnel.wait_for_handshake(self.connect_timeout)
+                if not handshake:
+                    report(server, f"{Colors.RED}✗ No handshake{Colors.END}")
+                    return
+                connect_time = time.monotonic() - started
                 
-                print(f"[{server_num}/{total}] Testing {server_name} (OpenVPN)")
+                with TRACER.span('measure', relay=server['server'], backend=self.backend_options['name']):
+                    completed = subprocess.run(tunnel.exec_command(worker_command), capture_output=True,
+                                               text=True, timeout=worker_timeout)
+                lines = completed.stdout.strip().splitlines()
+                metrics = json.loads(lines[-1]) if lines else {'error': f"exit code {completed.returncode}"}
+                if metrics.get('error'):
+                    report(server, f"{Colors.RED}✗ {metrics['error']}{Colors.END}")
+                    return
                 
-                if self.connect_to_specific_server(server_name):
-                    metrics = self.run_speed_test()
-                    if metrics:
-                        result = {
-                            'server': server_name,
-                            'country': server['country'],
-                            'city': server['city'],
-                            'provider': 'OpenVPN',
-                            'ping': metrics['ping'],
-                            'download': metrics['download'],
-                            'upload': metrics['upload'],
-                            'timestamp': datetime.now().isoformat()
-                        }
-                        self.results.append(result)
-                        tested_servers.add(server_name)
-                        
-                        print(f"    {Colors.GREEN}Download: {metrics['download']:.2f} Mbps | "
-                              f"Upload: {metrics['upload']:.2f} Mbps | "
-                              f"Ping: {metrics['ping']:.2f} ms{Colors.END}")
-                print()
+                result = self._build_result(server, 'WireGuard', metrics, connect_time)
+                with lock:
+                    self.record_result(result)
+                report(server, f"{Colors.GREEN}Download: {metrics['download']:.2f} Mbps | "
+                               f"Upload: {metrics['upload']:.2f} Mbps | "
+                               f"Ping: {metrics['ping']:.2f} ms{Colors.END}")
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError, ValueError) as e:
+                detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+                report(server, f"{Colors.RED}✗ Failed ({detail}){Colors.END}")
+            finally:
+                with TRACER.span('netns.down', relay=server['server']):
+                    tunnel.down()
+                slots.put(slot)
         
-        print(f"{Colors.GREEN}✓ Testing complete!{Colors.END}")
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(run, wg_servers))
+        finally:
+            os.unlink(key_file)
+        
+        print()
+        if other_servers:
+            print(f"{Colors.YELLOW}{len(other_servers)} servers cannot run in a namespace "
+                  f"(OpenVPN or unknown WireGuard key), testing them sequentially{Colors.END}")
+            self.test_servers(other_servers)
+        else:
+            print(f"{Colors.GREEN}✓ Testing complete!{Colors.END}")
     
     def connect_to_specific_server(self, server_hostname: str, max_retries: int = 3) -> bool:
+        return run_async(self.connect_async(server_hostname, max_retries))
+    
+    async def connect_async(self, server_hostname: str, max_retries: int = 3,
+                            run: Optional[ServerRun] = None) -> bool:
+        with TRACER.span('connect', relay=server_hostname) as span:
+            span.args['connected'] = await self._connect_attempts(server_hostname, max_retries, run)
+            return span.args['connected']
+    
+    async def _connect_attempts(self, server_hostname: str, max_retries: int,
+                                run: Optional[ServerRun]) -> bool:
         parts = server_hostname.split('-')
         if len(parts) < 3:
             return False
         
         country_code = parts[0]
         city_code = parts[1]
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        self.last_connect_time = None
         
         for attempt in range(1, max_retries + 1):
+            hot_switch = attempt == 1 and self.tunnel_connected
+            attempt_trace = time.perf_counter()
+            if attempt > 1:
+                TRACER.count('connect.retries')
+            listener = await self._start_status_listener()
+            if run and attempt > 1:
+                run.advance(ServerState.CONNECTING)
+            
             try:
-                subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
-                time.sleep(1)
+                if not hot_switch:
+                    await self._daemon_command('disconnect')
                 
                 if attempt == 1:
                     print(f"    Connecting to {server_hostname}...", end='', flush=True)
                 else:
                     print(f"    Retry {attempt}/{max_retries}...", end='', flush=True)
                 
-                subprocess.run(['mullvad', 'relay', 'set', 'location', 
-                             country_code, city_code, server_hostname],
-                             capture_output=True, text=True, check=False)
+                await self._daemon_command('relay', 'set', 'location', country_code, city_code, server_hostname)
                 
-                subprocess.run(['mullvad', 'connect'], capture_output=True, check=True)
-                time.sleep(10)  # Wait longer for connection to stabilize
+                if not hot_switch:
+                    returncode, _ = await self._daemon_command('connect')
+                    if returncode != 0:
+                        raise subprocess.CalledProcessError(returncode, 'mullvad connect')
                 
-                status_result = subprocess.run(['mullvad', 'status'],
-                                           capture_output=True, text=True, check=True)
+                attempt_started = loop.time()
+                with TRACER.span('connect.wait_for_tunnel'):
+                    ready = await self.wait_for_tunnel(server_hostname, listener, self.connect_timeout)
+                if ready:
+                    if run:
+                        run.advance(ServerState.VERIFYING)
+                    remaining = self.connect_timeout - (loop.time() - attempt_started)
+                    with TRACER.span('connect.traffic_probe'):
+                        ready = await self.tunnel_carries_traffic_async(max(remaining, 2.0))
                 
-                if 'Connected' in status_result.stdout:
-                    print(f" {Colors.GREEN}✓{Colors.END}")
+                if ready:
+                    self.tunnel_connected = True
+                    self.last_connect_time = loop.time() - started
+                    print(f" {Colors.GREEN}✓{Colors.END} ({self.last_connect_time:.1f}s)")
                     return True
                 
-                # Not connected, will retry
+                self.tunnel_connected = False
                 if attempt < max_retries:
                     print(f" {Colors.YELLOW}✗ Retrying...{Colors.END}")
-                    time.sleep(2)  # Brief pause before retry
+                    await self._pause('retry_backoff')
                 else:
                     print(f" {Colors.RED}✗ Failed after {max_retries} attempts{Colors.END}")
                     return False
+            
+            except asyncio.CancelledError:
+                self.tunnel_connected = False
+                raise
                     
             except Exception as e:
+                self.tunnel_connected = False
                 if attempt < max_retries:
                     print(f" {Colors.YELLOW}✗ Error, retrying...{Colors.END}")
-                    time.sleep(2)
+                    await self._pause('retry_backoff')
                 else:
                     print(f" {Colors.RED}✗ Failed after {max_retries} attempts{Colors.END}")
                     return False
+            
+            finally:
+                await self._stop_status_listener(listener)
+                TRACER.record('connect.attempt', attempt_trace,
+                              {'relay': server_hostname, 'attempt': attempt, 'hot_switch': hot_switch})
         
         return False
     
-    def run_speed_test(self) -> Optional[Dict]:
+    def _build_result(self, server: Relay, provider: str, metrics: Dict,
+                      connect_time: Optional[float] = None) -> Dict:
+        if connect_time is None:
+            connect_time = self.last_connect_time
+        result = {
+            'server': server['server'],
+            'country': server['country'],
+            'city': server['city'],
+            'provider': provider,
+            'ping': metrics['ping'],
+            'download': metrics['download'],
+            'upload': metrics['upload'],
+            'connect_time': round(connect_time, 2) if connect_time is not None else None,
+            'screen_rtt': self.screen_scores.get(server['server']),
+            'distance_km': self.distances.get(server['server']),
+            'timestamp': datetime.now().isoformat()
+        }
+        for key in ['test_server', 'bytes_received', 'bytes_sent', 'latency_samples', 'samples', 'stats',
+                    'streams', 'client_cpu', 'latency_under_load'] + LOAD_KEYS:
+            if key in metrics:
+                result[key] = metrics[key]
+        return result
+    
+    def run_speed_test(self, location_key: Optional[str] = None) -> Optional[Dict]:
         try:
             print("    Running speed test...", end='', flush=True)
             
-            result = subprocess.run(['speedtest-cli', '--simple'], 
-                                  capture_output=True, text=True, check=True, timeout=60)
-            
-            metrics = {}
-            for line in result.stdout.strip().split('\n'):
-                if 'Ping:' in line:
-                    metrics['ping'] = float(line.split(':')[1].strip().split()[0])
-                elif 'Download:' in line:
-                    metrics['download'] = float(line.split(':')[1].strip().split()[0])
-                elif 'Upload:' in line:
-                    metrics['upload'] = float(line.split(':')[1].strip().split()[0])
+            if self.backend is None:
+                self.backend = make_backend('speedtest')
+            with TRACER.span('measure', backend=self.backend.name):
+                metrics = self.measure_under_load(self.backend, location_key, self.measure_duration)
             
-            if all(k in metrics for k in ['ping', 'download', 'upload']):
+            if metrics:
                 print(f" {Colors.GREEN}✓{Colors.END}")
+                self._report_streams(metrics)
+                self._report_latency_under_load(metrics)
                 return metrics
             else:
                 print(f" {Colors.RED}✗{Colors.END}")
@@ -386,34 +2974,197 @@ class MullvadSpeedTester:
             print(f" {Colors.RED}✗ Failed ({str(e)}){Colors.END}")
             return None
     
+    def measure_under_load(self, backend: ThroughputBackend, location_key: Optional[str] = None,
+                           duration: Optional[float] = None) -> Optional[Dict]:
+        probe = None
+        if self.echo_target:
+            probe = LatencyProbe(self.echo_target[0], self.echo_target[1], self.echo_protocol, self.echo_rate)
+            try:
+                probe.start()
+            except OSError as e:
+                print(f" {Colors.YELLOW}(echo probe unavailable: {e}){Colors.END}", end='', flush=True)
+                probe = None
+            else:
+                with TRACER.span('echo.idle', target=f"{self.echo_target[0]}:{self.echo_target[1]}"):
+                    time.sleep(ECHO_IDLE_SECONDS)
+                probe.mark('loaded')
+        
+        summary = None
+        try:
+            metrics = backend.measure(location_key, duration)
+        finally:
+            if probe is not None:
+                summary = probe.stop()
+        if metrics and summary:
+            metrics.update(latency_under_load_metrics(summary))
+        return metrics
+    
+    def _report_latency_under_load(self, metrics: Dict):
+        summary = metrics.get('latency_under_load')
+        if not summary:
+            return
+        idle, loaded = summary.get('idle', {}), summary.get('loaded', {})
+        
+        def ms(value):
+            return f"{value:.1f} ms" if value is not None else '-'
+        
+        print(f"    Latency: idle {ms(idle.get('p50'))} → loaded {ms(loaded.get('p50'))} "
+              f"(p90 {ms(loaded.get('p90'))}, p99 {ms(loaded.get('p99'))}) | "
+              f"jitter {ms(loaded.get('jitter'))} | loss {loaded.get('loss', 0):.1f}%")
+    
+    def _report_streams(self, metrics: Dict):
+        streams = metrics.get('streams')
+        if streams:
+            failed = f", {streams['failed']} failed" if streams['failed'] else ''
+            print(f"    {streams['count']} streams{failed}: "
+                  f"down {' / '.join(f'{mbps:.0f}' for mbps in streams['download'])} Mbps | "
+                  f"up {' / '.join(f'{mbps:.0f}' for mbps in streams['upload'])} Mbps")
+        cpu = metrics.get('client_cpu') or {}
+        busiest = max((value for value in cpu.values() if value is not None), default=None)
+        if busiest is not None and busiest >= CLIENT_CPU_LIMIT:
+            print(f"    {Colors.YELLOW}⚠ Client CPU at {busiest:.0f}% of a core: the client, not the relay, "
+                  f"may be the bottleneck{Colors.END}")
+    
+    def _optional_columns(self, results: List[Dict]) -> List[Tuple[str, int, callable]]:
+        columns = []
+        if any(r.get('stats') for r in results):
+            columns.append(('P10-P90', 15, lambda r: f"{r['stats']['download']['p10']:.0f}-"
+                            f"{r['stats']['download']['p90']:.0f}" if r.get('stats') else '-'))
+            columns.append(('95% CI', 14, lambda r: f"±{(r['stats']['download']['ci95'][1] - r['stats']['download']['ci95'][0]) / 2:.1f} "
+                            f"(n={r['stats']['download']['n']})" if r.get('stats') and r['stats']['download']['ci95'] else
+                            f"n={r['stats']['download']['n'] if r.get('stats') else 1}"))
+        if any(r.get('distance_km') is not None for r in results):
+            columns.append(('Distance', 10, lambda r: f"{r['distance_km']:>6.0f} km"
+                            if r.get('distance_km') is not None else f"{'-':>6}"))
+        if any(r.get('client_cpu') for r in results):
+            columns.append(('Client CPU', 11, lambda r: f"{max(v for v in r['client_cpu'].values() if v is not None):>6.0f}%"
+                            if r.get('client_cpu') and any(v is not None for v in r['client_cpu'].values())
+                            else f"{'-':>6}"))
+        if any(r.get('loaded_ping') is not None for r in results):
+            columns.append(('Loaded', 10, lambda r: f"{r['loaded_ping']:>6.1f} ms"
+                            if r.get('loaded_ping') is not None else f"{'-':>6}"))
+            columns.append(('Jitter', 10, lambda r: f"{r['jitter']:>6.1f} ms"
+                            if r.get('jitter') is not None else f"{'-':>6}"))
+            columns.append(('Loss', 7, lambda r: f"{r['loss']:>5.1f}%"
+                            if r.get('loss') is not None else f"{'-':>5}"))
+        if any(r.get('screen_rtt') is not None for r in results):
+            columns.append(('Screen', 10, lambda r: f"{r['screen_rtt']:>6.1f} ms"
+                            if r.get('screen_rtt') is not None else f"{'-':>6}"))
+        return columns
+    
+    def rank_results(self) -> Tuple[List[Dict], str]:
+        if self.score:
+            scores, bounds = composite_scores(self.results, self.score)
+            weights = {metric: weight for metric, weight in self.score.items() if metric in bounds}
+            dropped = [metric for metric in self.score if metric not in bounds]
+            if dropped:
+                print(f"{Colors.YELLOW}No results carry {', '.join(dropped)}; scoring on the rest{Colors.END}")
+            for result, score in zip(self.results, scores):
+                result['score'] = score
+            label = f"score {format_weights(weights)}"
+            keys = ['score']
+        else:
+            label = ', then '.join(self.sort_by)
+            keys = self.sort_by
+        
+        def key(result: Dict) -> tuple:
+            return tuple(float('-inf') if result.get(k) is None else
+                         result[k] if k == 'score' or RANK_KEYS[k] else -result[k] for k in keys)
+        
+        if self.top and self.top < len(self.results):
+            ranked = heapq.nlargest(self.top, self.results, key=key)
+        else:
+            ranked = sorted(self.results, key=key, reverse=True)
+        for result in self.results:
+            result.pop('rank', None)
+            result.pop('ranked_by', None)
+        for position, result in enumerate(ranked, 1):
+            result['rank'] = position
+            result['ranked_by'] = label
+        return ranked, label
+    
+    def pareto_front(self) -> set:
+        metrics = list(self.score) if self.score else ['download', 'upload', 'ping']
+        metrics = [metric for metric in metrics if all(r.get(metric) is not None for r in self.results)]
+        if not metrics:
+            return set()
+        self.pareto_metrics = metrics
+        return {self.results[i]['server'] for i in pareto_front(self.results, metrics)}
+    
+    def display_pareto(self, front: set):
+        members = [r for r in self.results if r['server'] in front]
+        members.sort(key=lambda r: r['download'], reverse=True)
+        print()
+        print(f"{Colors.BOLD}PARETO FRONTIER{Colors.END} over {', '.join(self.pareto_metrics)}: "
+              f"{len(members)} of {len(self.results)} relays are not beaten on every metric by another")
+        for result in members:
+            values = ' | '.join(f"{metric} {result[metric]:g}" for metric in self.pareto_metrics)
+            print(f"  ★ {result['server']:<20} {values}")
+    
     def display_results(self):
         if not self.results:
             return
         
-        sorted_results = sorted(self.results, key=lambda x: x['download'], reverse=True)
+        sorted_results, label = self.rank_results()
+        front = self.pareto_front() if self.pareto else None
+        columns = self._optional_columns(sorted_results)
+        if self.score:
+            columns.insert(0, ('Score', 7, lambda r: f"{r['score']:>5.1f}" if r.get('score') is not None else f"{'-':>5}"))
+        if front is not None:
+            columns.append(('Pareto', 7, lambda r: f"{'★' if r['server'] in front else '':^6}"))
+        extra_header = ''.join(f" {title:<{width}}" for title, width, _ in columns)
+        sampled = any(r.get('stats') for r in sorted_results)
         
         print("=" * 120)
-        print(f"{Colors.BOLD}SPEED TEST RESULTS (Sorted by Download Speed){Colors.END}")
+        if label == 'download':
+            print(f"{Colors.BOLD}SPEED TEST RESULTS (Sorted by {'Median ' if sampled else ''}Download Speed){Colors.END}")
+        else:
+            print(f"{Colors.BOLD}SPEED TEST RESULTS (Ranked by {label}){Colors.END}")
+        if len(sorted_results) < len(self.results):
+            print(f"Top {len(sorted_results)} of {len(self.results)} relays")
         print("=" * 120)
         print()
         
-        print(f"{'Rank':<6} {'Server':<20} {'Location':<25} {'Provider':<12} {'Download':<15} {'Upload':<15} {'Ping':<10}")
+        print(f"{'Rank':<6} {'Server':<20} {'Location':<25} {'Provider':<12} {'Download':<15} {'Upload':<15} {'Ping':<10}{extra_header}")
         print("-" * 120)
         
         for i, result in enumerate(sorted_results, 1):
             location = f"{result['city']}, {result['country'][:2].upper()}"
-            print(f"{i:<6} {result['server']:<20} {location:<25} {result['provider']:<12} "
-                  f"{result['download']:>6.2f} Mbps   {result['upload']:>6.2f} Mbps   {result['ping']:>6.2f} ms")
+            row = (f"{i:<6} {result['server']:<20} {location:<25} {result['provider']:<12} "
+                   f"{result['download']:>6.2f} Mbps   {result['upload']:>6.2f} Mbps   {result['ping']:>6.2f} ms")
+            if columns:
+                row = f"{row:<109}" + ''.join(f" {render(result):<{width}}" for _, width, render in columns)
+            print(row)
+        
+        self.display_locations(sorted_results)
+        
+        screened = [r for r in sorted_results if r.get('screen_rtt') is not None]
+        correlation = rank_correlation([-r['screen_rtt'] for r in screened], [r['download'] for r in screened])
+        if correlation is not None:
+            print()
+            print(f"Pre-screen vs measured download rank correlation: {correlation:+.2f} "
+                  f"(1.0 = screening predicted the ranking perfectly)")
+        
+        if front is not None:
+            self.display_pareto(front)
         
         print()
         print("=" * 120)
         
         fastest = sorted_results[0]
-        print(f"{Colors.GREEN}🏆 FASTEST SERVER:{Colors.END}")
+        if label == 'download':
+            print(f"{Colors.GREEN}🏆 FASTEST SERVER:{Colors.END}")
+        elif self.score:
+            print(f"{Colors.GREEN}🏆 BEST SERVER (score {fastest['score']:.1f} of 100):{Colors.END}")
+        else:
+            print(f"{Colors.GREEN}🏆 BEST SERVER BY {label.upper()}:{Colors.END}")
         print(f"   Server: {fastest['server']}")
         print(f"   Location: {fastest['country']} - {fastest['city']}")
         print(f"   Provider: {fastest['provider']}")
         print(f"   Download: {fastest['download']:.2f} Mbps | Upload: {fastest['upload']:.2f} Mbps | Ping: {fastest['ping']:.2f} ms")
+        if fastest.get('loaded_ping') is not None:
+            print(f"   Under load: {fastest['loaded_ping']:.1f} ms (idle {fastest.get('idle_ping') or 0:.1f} ms) | "
+                  f"Jitter: {fastest.get('jitter') or 0:.1f} ms | Loss: {fastest.get('loss') or 0:.1f}%")
         print("=" * 120)
         
         praise_messages = [
@@ -445,6 +3196,39 @@ class MullvadSpeedTester:
         
         print(f"\n{Colors.YELLOW}💫 {random.choice(praise_messages)} 💫{Colors.END}\n")
     
+    def display_locations(self, sorted_results: List[Dict]):
+        locations = {}
+        for result in sorted_results:
+            locations.setdefault((result['city'], result['country']), []).append(result)
+        if len(locations) < 2:
+            return
+        
+        print()
+        print(f"{Colors.BOLD}BY LOCATION{Colors.END}")
+        print(f"{'Location':<30} {'Tested':<8} {'Best Server':<20} {'Best':<15} {'Median':<15} {'Ping':<10}")
+        print("-" * 120)
+        for (city, country), results in locations.items():
+            location = f"{city}, {country}"
+            print(f"{location:<30} {len(results):<8} {results[0]['server']:<20} "
+                  f"{results[0]['download']:>6.2f} Mbps   {median([r['download'] for r in results]):>6.2f} Mbps   "
+                  f"{median([r['ping'] for r in results]):>6.2f} ms")
+    
+    def display_timings(self):
+        rows = TRACER.summary()
+        if not rows:
+            return
+        
+        print(f"{Colors.BOLD}PHASE TIMINGS{Colors.END}")
+        print(f"{'Phase':<34} {'Count':>6} {'Total':>10} {'Mean':>10} {'P50':>10} {'P95':>10} {'Max':>10}")
+        print("-" * 96)
+        for row in rows:
+            print(f"{row['phase']:<34} {row['count']:>6} {row['total']:>9.2f}s {row['mean']:>9.3f}s "
+                  f"{row['p50']:>9.3f}s {row['p95']:>9.3f}s {row['max']:>9.3f}s")
+        if TRACER.counters:
+            print()
+            print('  '.join(f"{name}: {value}" for name, value in sorted(TRACER.counters.items())))
+        print()
+    
     def save_results(self, filename: str):
         if self.results:
             with open(filename, 'w') as f:
@@ -456,10 +3240,12 @@ class MullvadSpeedTester:
         print(f"  Resetting protocol to automatic...", end='', flush=True)
         subprocess.run(['mullvad', 'relay', 'set', 'tunnel-protocol', 'any'],
                      capture_output=True, check=False)
+        self.current_protocol = None
         print(f" {Colors.GREEN}✓{Colors.END}")
         
         print(f"  Disconnecting...", end='', flush=True)
         subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
+        self.tunnel_connected = False
         print(f" {Colors.GREEN}✓{Colors.END}")
         
         print(f"{Colors.GREEN}Done! You can now reconnect to Mullvad manually.{Colors.END}")
@@ -482,7 +3268,7 @@ class MullvadSpeedTester:
                 idx = i + j
                 if idx < len(countries):
                     country = countries[idx]
-                    count = len([r for r in self.all_relays if r['country'] == country])
+                    count = self.catalog.country_counts[country]
                     row.append(f"{idx + 1:3d}. {country:<25} ({count} servers)")
             print("  ".join(row))
         
@@ -637,15 +3423,17 @@ class MullvadSpeedTester:
         print("  1. Test first N servers (quick)")
         print("  2. Choose specific server(s) to test (custom)")
         print("  3. Test all available servers (comprehensive)")
+        print("  4. Pre-screen all by latency, test the N closest (fast)")
+        print("  5. Best answer within a time budget (timed)")
         
         while True:
-            choice = input(f"{Colors.GREEN}Select mode [1-3, default: 1]: {Colors.END}").strip() or '1'
+            choice = input(f"{Colors.GREEN}Select mode [1-5, default: 1]: {Colors.END}").strip() or '1'
             
             if choice == '1':
                 print()
                 print(f"Number of servers to test:")
                 print(f"  Available: {total_servers}")
-                print(f"  Recommended: 5-10 (~5-10 minutes)")
+                print(f"  Recommended: 5-10 (~{self.estimate_minutes(5)}-{self.estimate_minutes(10)} minutes)")
                 
                 while True:
                     limit_input = input(f"{Colors.GREEN}Enter number (default: 10): {Colors.END}").strip() or '10'
@@ -671,7 +3459,39 @@ class MullvadSpeedTester:
             elif choice == '3':
                 options['limit'] = total_servers
                 options['specific_servers'] = None
-                print(f"{Colors.YELLOW}Will test all {total_servers} servers (~{total_servers} minutes){Colors.END}")
+                print(f"{Colors.YELLOW}Will test all {total_servers} servers (~{self.estimate_minutes(total_servers)} minutes){Colors.END}")
+                break
+            
+            elif choice == '4':
+                print()
+                limit_input = input(f"{Colors.GREEN}Servers to test after screening (default: 5): {Colors.END}").strip() or '5'
+                try:
+                    limit = int(limit_input)
+                except ValueError:
+                    print(f"{Colors.RED}Invalid input{Colors.END}")
+                    continue
+                if limit <= 0:
+                    print(f"{Colors.RED}Please enter a positive number{Colors.END}")
+                    continue
+                options['limit'] = min(limit, total_servers)
+                options['prescreen'] = options['limit']
+                options['specific_servers'] = None
+                break
+            
+            elif choice == '5':
+                print()
+                minutes_input = input(f"{Colors.GREEN}Minutes to spend (default: 3): {Colors.END}").strip() or '3'
+                try:
+                    minutes = float(minutes_input)
+                except ValueError:
+                    print(f"{Colors.RED}Invalid input{Colors.END}")
+                    continue
+                if minutes <= 0:
+                    print(f"{Colors.RED}Please enter a positive number{Colors.END}")
+                    continue
+                options['time_budget'] = minutes * 60
+                options['limit'] = None
+                options['specific_servers'] = None
                 break
             else:
                 print(f"{Colors.RED}Invalid choice{Colors.END}")
@@ -697,6 +3517,11 @@ class MullvadSpeedTester:
         
         if options.get('specific_servers'):
             print(f"  Servers to test: {Colors.CYAN}{len(options['specific_servers'])} specific servers{Colors.END}")
+        elif options.get('prescreen'):
+            print(f"  Servers to test: {Colors.CYAN}{options['limit']} lowest-latency of {total_servers}{Colors.END}")
+        elif options.get('time_budget'):
+            print(f"  Servers to test: {Colors.CYAN}as many of {total_servers} as fit in "
+                  f"{options['time_budget'] / 60:g} minutes{Colors.END}")
         else:
             print(f"  Servers to test: {Colors.CYAN}{options['limit']}{Colors.END}")
         
@@ -710,8 +3535,1045 @@ class MullvadSpeedTester:
         
         return options
 
-def interactive_mode():
+def make_reference_server(port: int, bind: str = '0.0.0.0'):
+    import http.server
+    
+    class ReferenceHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+        chunk = b'\0' * (64 * 1024)
+        
+        def log_message(self, format, *args):
+            pass
+        
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if not parts.path.rstrip('/').endswith('download'):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+                return
+            
+            size = int(parse_qs(parts.query).get('bytes', [str(10 * 1024 ** 3)])[0])
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            try:
+                while size > 0:
+                    block = self.chunk if size >= len(self.chunk) else self.chunk[:size]
+                    self.wfile.write(block)
+                    size -= len(block)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+        
+        def do_POST(self):
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, 1024 * 1024))
+                if not data:
+                    self.close_connection = True
+                    return
+                remaining -= len(data)
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+    
+    return http.server.ThreadingHTTPServer((bind, port), ReferenceHandler)
+
+def serve_reference(port: int):
+    server = make_reference_server(port)
+    print(f"{Colors.GREEN}Reference server listening on port {port}{Colors.END}")
+    print(f"  Download: http://<host>:{port}/download")
+    print(f"  Upload:   http://<host>:{port}/upload")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def make_echo_servers(port: int, bind: str = '0.0.0.0'):
+    class UdpEchoHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            sock.sendto(data, self.client_address)
+    
+    class TcpEchoHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    self.request.sendall(data)
+            except OSError:
+                pass
+    
+    class UdpEchoServer(socketserver.UDPServer):
+        allow_reuse_address = True
+    
+    class TcpEchoServer(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+    
+    return UdpEchoServer((bind, port), UdpEchoHandler), TcpEchoServer((bind, port), TcpEchoHandler)
+
+def serve_echo(port: int):
+    servers = make_echo_servers(port)
+    print(f"{Colors.GREEN}Echo server listening on UDP and TCP port {port}{Colors.END}")
+    print(f"  Probe with: --echo-target <host>:{port}")
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+class MonitorMetrics:
+    GAUGES = [
+        ('download_mbps', 'download', 'Latest download throughput in Mbit/s'),
+        ('upload_mbps', 'upload', 'Latest upload throughput in Mbit/s'),
+        ('ping_ms', 'ping', 'Latest latency in milliseconds'),
+        ('connect_seconds', 'connect_time', 'Latest connect-to-ready time in seconds'),
+        ('last_success_timestamp_seconds', 'last_success', 'Unix time of the last successful measurement'),
+    ]
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.relays = {}
+        self.cycles = 0
+        self.tunnel_seconds = 0.0
+    
+    def _entry(self, server: str, country: str, city: str, protocol: str) -> Dict:
+        entry = self.relays.get(server)
+        if entry is None:
+            entry = self.relays[server] = {'labels': {'server': server, 'country': country, 'city': city,
+                                                      'protocol': protocol.lower()},
+                                           'ok': 0, 'failed': 0}
+        return entry
+    
+    def record(self, result: Dict):
+        with self._lock:
+            entry = self._entry(result['server'], result['country'], result['city'], result['provider'])
+            entry['ok'] += 1
+            entry['last_success'] = datetime.fromisoformat(result['timestamp']).timestamp()
+            for key in ('download', 'upload', 'ping', 'connect_time'):
+                if result.get(key) is not None:
+                    entry[key] = result[key]
+    
+    def record_failure(self, relay: Relay):
+        with self._lock:
+            self._entry(relay['server'], relay['country'], relay['city'], relay['provider'])['failed'] += 1
+    
+    def add_cycle(self, tunnel_seconds: float):
+        with self._lock:
+            self.cycles += 1
+            self.tunnel_seconds += tunnel_seconds
+    
+    @staticmethod
+    def _labels(labels: Dict) -> str:
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            entries = [dict(entry, labels=dict(entry['labels'])) for entry in self.relays.values()]
+            cycles, tunnel_seconds = self.cycles, self.tunnel_seconds
+        
+        for name, key, help_text in self.GAUGES:
+            lines.append(f"# TYPE tbi_speed_{name} gauge")
+            lines.append(f"# HELP tbi_speed_{name} {help_text}")
+            for entry in entries:
+                if entry.get(key) is not None:
+                    lines.append(f"tbi_speed_{name}{self._labels(entry['labels'])} {entry[key]}")
+        
+        lines.append("# TYPE tbi_speed_tests counter")
+        lines.append("# HELP tbi_speed_tests Measurements attempted per relay by outcome")
+        for entry in entries:
+            for outcome in ('ok', 'failed'):
+                lines.append(f"tbi_speed_tests_total{self._labels(dict(entry['labels'], result=outcome))} {entry[outcome]}")
+        
+        lines.append("# TYPE tbi_speed_cycles counter")
+        lines.append("# HELP tbi_speed_cycles Completed monitoring cycles")
+        lines.append(f"tbi_speed_cycles_total {cycles}")
+        lines.append("# TYPE tbi_speed_tunnel_seconds counter")
+        lines.append("# HELP tbi_speed_tunnel_seconds Time spent with a test tunnel up")
+        lines.append(f"tbi_speed_tunnel_seconds_total {tunnel_seconds:.3f}")
+        lines.append("# EOF")
+        return '\n'.join(lines) + '\n'
+
+def make_metrics_server(port: int, metrics: MonitorMetrics, bind: str = '127.0.0.1'):
+    import http.server
+    
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+        
+        def do_GET(self):
+            if self.path.split('?')[0].rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    return http.server.ThreadingHTTPServer((bind, port), MetricsHandler)
+
+def run_daemon(args):
+    tester = MullvadSpeedTester()
+    configure_tester(tester, args)
+    
+    print(f"{Colors.BOLD}TBI Speed for Mullvad v3.0 - monitor{Colors.END}")
+    print("=" * 50)
+    tester.check_requirements()
+    print()
+    
+    metrics = MonitorMetrics()
+    tester.result_listeners.append(metrics.record)
+    try:
+        server = make_metrics_server(args.metrics_port, metrics, args.metrics_bind)
+    except OSError as e:
+        print(f"{Colors.RED}Cannot listen on {args.metrics_bind}:{args.metrics_port} ({e}){Colors.END}")
+        sys.exit(1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"{Colors.GREEN}Metrics at http://{args.metrics_bind}:{args.metrics_port}/metrics{Colors.END}\n")
+    
+    if not IS_WINDOWS:
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+        
+        signal.signal(signal.SIGTERM, terminate)
+    
+    share = min(max(args.max_tunnel_share, 0.01), 1.0)
+    tester.get_all_relays(force_refresh=args.refresh)
+    fetched_at = time.monotonic()
+    tester.original_server = tester.get_connected_server()
+    tester.tunnel_connected = tester.original_server is not None
+    position = 0
+    
+    try:
+        while True:
+            if time.monotonic() - fetched_at > tester.cache_ttl:
+                tester.get_all_relays(force_refresh=True)
+                fetched_at = time.monotonic()
+            
+            relays = tester.select_relays(args.country, args.city, args.region, args.provider)
+            if args.limit:
+                relays = relays[:args.limit]
+            if not relays:
+                print(f"{Colors.RED}No servers match the monitored set{Colors.END}")
+                time.sleep(args.interval)
+                continue
+            
+            batch = [relays[(position + i) % len(relays)] for i in range(min(args.daemon_batch, len(relays)))]
+            position = (position + len(batch)) % len(relays)
+            
+            print(f"{Colors.CYAN}[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                  f"Cycle {metrics.cycles + 1}: {', '.join(relay['server'] for relay in batch)}{Colors.END}")
+            tester.results = []
+            started = time.monotonic()
+            try:
+                tester.test_servers(batch)
+            finally:
+                subprocess.run(['mullvad', 'disconnect'], capture_output=True, check=False)
+                tester.tunnel_connected = False
+                tunnel_seconds = time.monotonic() - started
+                metrics.add_cycle(tunnel_seconds)
+            
+            for run in tester.server_runs:
+                if run.state == ServerState.FAILED:
+                    metrics.record_failure(run.server)
+            
+            interval = args.interval * random.uniform(1 - args.jitter, 1 + args.jitter)
+            delay = max(interval - tunnel_seconds, tunnel_seconds / share - tunnel_seconds, 0.0)
+            print(f"Tunnel up {tunnel_seconds:.1f}s, next cycle in {delay:.0f}s\n")
+            time.sleep(delay)
+    
+    except KeyboardInterrupt:
+        print(f"\n{Colors.YELLOW}Stopping monitor{Colors.END}")
+    
+    finally:
+        server.shutdown()
+        server.server_close()
+        tester.restore_original_connection()
+
+def measure_worker(args):
+    tester = MullvadSpeedTester()
+    tester.traffic_probe = parse_host_port(args.probe_host, TRAFFIC_PROBE[1])
+    if args.echo_target:
+        tester.echo_target = parse_host_port(args.echo_target, ECHO_PORT)
+        tester.echo_protocol = args.echo_protocol
+        tester.echo_rate = args.echo_rate
+    try:
+        backend = make_backend(args.backend, args.target, args.upload_url, args.test_duration, args.streams)
+        if not tester.tunnel_carries_traffic(args.connect_timeout):
+            metrics = {'error': 'tunnel carries no traffic'}
+        else:
+            metrics = tester.measure_under_load(backend) or {'error': 'measurement failed'}
+    except Exception as e:
+        metrics = {'error': str(e) or e.__class__.__name__}
+    print(json.dumps(metrics))
+
+def netns_selftest(relay_count: int = 3, concurrency: int = 2) -> bool:
+    if not IS_LINUX or os.geteuid() != 0:
+        print(f"{Colors.RED}The namespace self-test needs Linux and root{Colors.END}")
+        return False
+    
+    def run(command: List[str], **kwargs) -> str:
+        return subprocess.run(command, capture_output=True, text=True, check=True, **kwargs).stdout.strip()
+    
+    def keypair() -> Tuple[str, str]:
+        private_key = run(['wg', 'genkey'])
+        return private_key, run(['wg', 'pubkey'], input=private_key)
+    
+    workdir = tempfile.mkdtemp(prefix='tbi-selftest-')
+    namespaces = []
+    servers = []
+    relays = []
+    peers = {}
+    
+    try:
+        client_private, client_public = keypair()
+        
+        for i in range(relay_count):
+            namespace = f"tbi-relay{i}"
+            root_end, relay_end = f"tbi-vr{i}", f"tbi-vp{i}"
+            subprocess.run(['ip', 'netns', 'del', namespace], capture_output=True, check=False)
+            run(['ip', 'netns', 'add', namespace])
+            namespaces.append(namespace)
+            
+            run(['ip', 'link', 'add', root_end, 'type', 'veth', 'peer', 'name', relay_end])
+            run(['ip', 'link', 'set', relay_end, 'netns', namespace])
+            run(['ip', 'addr', 'add', f"10.199.{i}.1/30", 'dev', root_end])
+            run(['ip', 'link', 'set', root_end, 'up'])
+            run(['ip', '-n', namespace, 'addr', 'add', f"10.199.{i}.2/30", 'dev', relay_end])
+            run(['ip', '-n', namespace, 'link', 'set', relay_end, 'up'])
+            run(['ip', '-n', namespace, 'link', 'set', 'lo', 'up'])
+            
+            server_private, server_public = keypair()
+            key_file = os.path.join(workdir, f"relay{i}.key")
+            with open(key_file, 'w') as f:
+                f.write(server_private + '\n')
+            run(['ip', '-n', namespace, 'link', 'add', 'wg0', 'type', 'wireguard'])
+            run(['ip', 'netns', 'exec', namespace, 'wg', 'set', 'wg0', 'listen-port', str(WIREGUARD_PORT),
+                 'private-key', key_file, 'peer', client_public, 'allowed-ips', '10.200.0.2/32'])
+            run(['ip', '-n', namespace, 'addr', 'add', '10.200.0.1/24', 'dev', 'wg0'])
+            run(['ip', '-n', namespace, 'link', 'set', 'wg0', 'up'])
+            
+            servers.append(subprocess.Popen(['ip', 'netns', 'exec', namespace, sys.executable,
+                                             os.path.abspath(__file__), '--serve-reference', '8080'],
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            
+            hostname = f"xx-loc-wg-{i + 1:03d}"
+            relays.append(Relay('Selftest', 'Local', hostname, 'wireguard', f"10.199.{i}.2"))
+            peers[hostname] = {'public_key': server_public, 'ipv4': f"10.199.{i}.2"}
+        
+        time.sleep(1)
+        tester = MullvadSpeedTester()
+        tester.traffic_probe = ('10.200.0.1', 8080)
+        tester.connect_timeout = 10.0
+        tester.backend_options = {'name': 'http', 'target': 'http://10.200.0.1:8080/download', 'duration': 2.0}
+        tester.test_servers_parallel(relays, concurrency=concurrency,
+                                     device={'private_key': client_private, 'addresses': ['10.200.0.2/32']},
+                                     peers=peers)
+        tester.display_results()
+        
+        passed = len(tester.results) == relay_count
+        if passed:
+            print(f"{Colors.GREEN}✓ Namespace self-test passed ({relay_count} relays, {concurrency} parallel){Colors.END}")
+        else:
+            print(f"{Colors.RED}✗ Namespace self-test failed ({len(tester.results)}/{relay_count} relays measured){Colors.END}")
+        return passed
+    
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+        print(f"{Colors.RED}✗ Namespace self-test setup failed ({detail}){Colors.END}")
+        return False
+    
+    finally:
+        for server in servers:
+            server.terminate()
+        for namespace in namespaces:
+            subprocess.run(['ip', 'netns', 'del', namespace], capture_output=True, check=False)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+BENCH_FAKE_MULLVAD = r'''
+import json, os, random, sys, time
+base = os.environ['TBI_FAKE_DIR']
+with open(os.path.join(base, 'config.json')) as f:
+    config = json.load(f)
+with open(os.path.join(base, 'calls.log'), 'a') as f:
+    f.write('mullvad ' + ' '.join(sys.argv[1:]) + '\n')
+state_path = os.path.join(base, 'state.json')
+
+def load():
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'state': 'disconnected', 'relay': None, 'ready_at': 0, 'attempts': {}, 'tests': 0}
+
+def save(state):
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+def start(state):
+    host = state['relay']
+    attempt = state['attempts'].get(host, 0) + 1
+    state['attempts'][host] = attempt
+    rng = random.Random(f"{config['seed']}:{host}:{attempt}")
+    state['state'] = 'failing' if rng.random() < config['failure_rate'] else 'connecting'
+    state['ready_at'] = time.time() + config['connect_latency'] * rng.uniform(0.5, 1.5)
+
+def status(state):
+    if state['state'] == 'connecting' and time.time() >= state['ready_at']:
+        return f"Connected to {state['relay']} in Benchmark"
+    if state['state'] in ('connecting', 'failing'):
+        return f"Connecting to {state['relay']}"
+    return 'Disconnected'
+
+args = sys.argv[1:]
+state = load()
+if args == ['status']:
+    print(status(state))
+elif args == ['status', 'listen']:
+    last = None
+    while True:
+        line = status(load())
+        if line != last:
+            print(line, flush=True)
+            last = line
+        time.sleep(0.02)
+elif args[:2] == ['relay', 'list']:
+    with open(os.path.join(base, 'relays.txt')) as f:
+        sys.stdout.write(f.read())
+elif args[:3] == ['relay', 'set', 'location']:
+    state['relay'] = args[-1]
+    if state['state'] != 'disconnected':
+        start(state)
+    save(state)
+elif args == ['connect']:
+    start(state)
+    save(state)
+elif args == ['disconnect']:
+    state['state'] = 'disconnected'
+    save(state)
+'''
+
+BENCH_FAKE_SPEEDTEST = r'''
+import json, os, random, sys, time
+base = os.environ['TBI_FAKE_DIR']
+with open(os.path.join(base, 'config.json')) as f:
+    config = json.load(f)
+with open(os.path.join(base, 'calls.log'), 'a') as f:
+    f.write('speedtest-cli ' + ' '.join(sys.argv[1:]) + '\n')
+if '--version' in sys.argv:
+    print('speedtest-cli 2.1.3')
+    sys.exit(0)
+state_path = os.path.join(base, 'state.json')
+with open(state_path) as f:
+    state = json.load(f)
+state['tests'] = state.get('tests', 0) + 1
+with open(state_path + '.tmp', 'w') as f:
+    json.dump(state, f)
+os.replace(state_path + '.tmp', state_path)
+rng = random.Random(f"{config['seed']}:{state['relay']}:{state['tests']}")
+time.sleep(config['test_seconds'])
+mean, sd = config['throughput']
+download = max(1.0, rng.gauss(mean, sd))
+print(f"Ping: {rng.uniform(5, 40):.3f} ms")
+print(f"Download: {download:.2f} Mbit/s")
+print(f"Upload: {download * rng.uniform(0.3, 0.6):.2f} Mbit/s")
+'''
+
+def synthetic_relay_list(count: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        if i % 100 == 0:
+            code = f"{chr(97 + i // 2600 % 26)}{chr(97 + i // 100 % 26)}"
+            lines.append(f"Country {i // 100} ({code})")
+        if i % 10 == 0:
+            city = f"c{i // 10 % 10:02d}"
+            lines.append(f"\tCity {i // 10} ({city}) @ {rng.uniform(-60, 60):.5f}°N, {rng.uniform(-180, 180):.5f}°E")
+        wireguard = rng.random() < 0.75
+        host = f"{code}-{city}-{'wg' if wireguard else 'ovpn'}-{i % 10 + 1:03d}"
+        address = f"127.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255 or 1}"
+        if wireguard:
+            lines.append(f"\t\t{host} ({address}, ::1) - WireGuard, hosted by M247 (rented)")
+        else:
+            lines.append(f"\t\t{host} ({address}) - OpenVPN, hosted by 31173 (Mullvad-owned)")
+    return '\n'.join(lines) + '\n'
+
+def synthetic_relay_data(count: int, seed: int = 1) -> Dict:
+    rng = random.Random(seed)
+    countries = {}
+    for relay in MullvadSpeedTester().parse_relay_list(synthetic_relay_list(count, seed)):
+        country = countries.setdefault(relay.country, {'name': relay.country, 'code': relay.server[:2], 'cities': {}})
+        city = country['cities'].get(relay.city)
+        if city is None:
+            city = country['cities'][relay.city] = {
+                'name': relay.city, 'code': relay.server[3:6], 'latitude': round(rng.uniform(-60, 60), 5),
+                'longitude': round(rng.uniform(-180, 180), 5), 'relays': []}
+        city['relays'].append({
+            'hostname': relay.server, 'ipv4_addr_in': relay.ipv4, 'ipv6_addr_in': relay.ipv6,
+            'include_in_country': True, 'active': rng.random() > 0.02, 'owned': relay.owned,
+            'provider': relay.hoster, 'weight': rng.choice([100, 200, 500]),
+            'endpoint_data': ({'Wireguard': {'public_key': f"{relay.server}-key"}}
+                              if relay.provider == 'wireguard' else 'Openvpn')})
+    return {'etag': f"synthetic-{count}-{seed}",
+            'countries': [dict(country, cities=list(country['cities'].values())) for country in countries.values()]}
+
+def benchmark_parse(sizes: List[int], seed: int = 1, repeats: int = 5) -> Dict[str, Dict]:
+    tester = MullvadSpeedTester()
+    timings = {}
+    for size in sizes:
+        text = synthetic_relay_list(size, seed)
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(synthetic_relay_data(size, seed), f)
+        parse_times, json_times, catalog_times = [], [], []
+        try:
+            for _ in range(repeats):
+                started = time.perf_counter()
+                relays = tester.parse_relay_list(text)
+                parse_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                load_relay_data(f.name)
+                json_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                RelayCatalog(relays)
+                catalog_times.append(time.perf_counter() - started)
+        finally:
+            os.unlink(f.name)
+        timings[str(size)] = {'relays': len(relays), 'parse_ms': round(min(parse_times) * 1000, 2),
+                              'json_ms': round(min(json_times) * 1000, 2),
+                              'catalog_ms': round(min(catalog_times) * 1000, 2)}
+    return timings
+
+def make_bench_dir(relay_count: int, connect_latency: float, failure_rate: float,
+                   throughput: Tuple[float, float], seed: int, test_seconds: float = 0.05) -> str:
+    workdir = tempfile.mkdtemp(prefix='tbi-bench-')
+    for name, source in (('mullvad', BENCH_FAKE_MULLVAD), ('speedtest-cli', BENCH_FAKE_SPEEDTEST)):
+        path = os.path.join(workdir, name)
+        with open(path, 'w') as f:
+            f.write(f"#!{sys.executable}\n{source}")
+        os.chmod(path, 0o755)
+    write_json_atomic(os.path.join(workdir, 'config.json'), {
+        'seed': seed, 'connect_latency': connect_latency, 'failure_rate': failure_rate,
+        'throughput': list(throughput), 'test_seconds': test_seconds})
+    with open(os.path.join(workdir, 'relays.txt'), 'w') as f:
+        f.write(synthetic_relay_list(relay_count, seed))
+    write_json_atomic(os.path.join(workdir, 'relays.json'), synthetic_relay_data(relay_count, seed))
+    return workdir
+
+def count_bench_calls(workdir: str) -> int:
+    try:
+        with open(os.path.join(workdir, 'calls.log')) as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+def benchmark_startup(relay_count: int, seed: int, repeats: int = 5) -> Dict:
+    workdir = make_bench_dir(relay_count, 0.0, 0.0, (100.0, 20.0), seed)
+    cache_dir = os.path.join(workdir, 'cache')
+    env = dict(os.environ, PATH=workdir + os.pathsep + os.environ.get('PATH', ''),
+               TBI_FAKE_DIR=workdir, TBI_SPEED_CACHE_DIR=cache_dir)
+    script = os.path.abspath(__file__)
+    list_command = [sys.executable, script, '--list', '--country', 'Country 0', '--backend', 'speedtest-cli',
+                    '--relay-data', os.path.join(workdir, 'relays.json'), '--no-splash']
+    import_command = [sys.executable, '-c', f"import sys; sys.path.insert(0, {os.path.dirname(script)!r}); "
+                                            f"import {os.path.splitext(os.path.basename(script))[0]}"]
+    
+    def timed(command: List[str], cold: bool) -> Tuple[float, int]:
+        best, calls = None, 0
+        for _ in range(repeats):
+            if cold:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            calls_before = count_bench_calls(workdir)
+            started = time.perf_counter()
+            subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - started
+            calls = count_bench_calls(workdir) - calls_before
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, calls
+    
+    try:
+        interpreter_ms, _ = timed([sys.executable, '-c', 'pass'], False)
+        import_ms, _ = timed(import_command, False)
+        cold_ms, cold_calls = timed(list_command, True)
+        warm_ms, warm_calls = timed(list_command, False)
+        return {
+            'interpreter_ms': round(interpreter_ms, 1),
+            'import_ms': round(import_ms - interpreter_ms, 1),
+            'cold_ms': round(cold_ms, 1),
+            'warm_ms': round(warm_ms, 1),
+            'subprocesses_cold': cold_calls,
+            'subprocesses_warm': warm_calls,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def benchmark_sweep(relay_count: int, connect_latency: float, failure_rate: float,
+                    throughput: Tuple[float, float], seed: int, test_seconds: float = 0.05) -> Dict:
+    workdir = make_bench_dir(relay_count, connect_latency, failure_rate, throughput, seed, test_seconds)
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('127.0.0.1', 0))
+    probe.listen(64)
+    
+    def accept():
+        while True:
+            try:
+                connection, _ = probe.accept()
+            except OSError:
+                return
+            connection.close()
+    
+    threading.Thread(target=accept, daemon=True).start()
+    saved_env = {key: os.environ.get(key) for key in ('PATH', 'TBI_FAKE_DIR')}
+    os.environ['PATH'] = workdir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['TBI_FAKE_DIR'] = workdir
+    
+    try:
+        tester = MullvadSpeedTester()
+        tester.traffic_probe = probe.getsockname()
+        tester.connect_timeout = max(2.0, connect_latency * 4)
+        tester.backend = SpeedtestCliBackend()
+        tester.relay_data_path = os.path.join(workdir, 'relays.json')
+        relays = tester.fetch_relays()
+        
+        calls_before = count_bench_calls(workdir)
+        TRACER.reset()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tester.test_servers(relays)
+        wall = time.perf_counter() - started
+        calls = count_bench_calls(workdir) - calls_before
+        
+        connect_times = [r['connect_time'] for r in tester.results if r.get('connect_time') is not None]
+        return {
+            'relays': len(relays),
+            'measured': len(tester.results),
+            'wall_seconds': round(wall, 3),
+            'wall_per_relay': round(wall / len(relays), 3),
+            'subprocesses_per_relay': round(calls / len(relays), 2),
+            'fixed_sleep_per_relay': round(tester.fixed_sleep_seconds / len(relays), 3),
+            'connect_per_relay': round(sum(connect_times) / len(connect_times), 3) if connect_times else None,
+            'phases': {row['phase']: round(row['total'] / len(relays), 4) for row in TRACER.summary()}
+        }
+    
+    finally:
+        probe.close()
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    
+    def check(label: str, current: Optional[float], previous: Optional[float], slack: float):
+        if current is None or previous is None:
+            return
+        if current > previous * (1 + slack) + 0.005:
+            regressions.append(f"{label}: {previous:g} → {current:g}")
+    
+    sweep, previous_sweep = report.get('sweep', {}), baseline.get('sweep', {})
+    check('wall per relay (s)', sweep.get('wall_per_relay'), previous_sweep.get('wall_per_relay'), tolerance)
+    check('subprocesses per relay', sweep.get('subprocesses_per_relay'),
+          previous_sweep.get('subprocesses_per_relay'), tolerance)
+    check('fixed sleep per relay (s)', sweep.get('fixed_sleep_per_relay'),
+          previous_sweep.get('fixed_sleep_per_relay'), 0.0)
+    for size, timings in report.get('parse', {}).items():
+        previous = baseline.get('parse', {}).get(size, {})
+        check(f"parse {size} relays (ms)", timings['parse_ms'], previous.get('parse_ms'), tolerance)
+        check(f"relays.json {size} relays (ms)", timings.get('json_ms'), previous.get('json_ms'), tolerance)
+        check(f"catalog {size} relays (ms)", timings['catalog_ms'], previous.get('catalog_ms'), tolerance)
+    startup, previous_startup = report.get('startup', {}), baseline.get('startup', {})
+    check('module import (ms)', startup.get('import_ms'), previous_startup.get('import_ms'), tolerance)
+    check('warm start (ms)', startup.get('warm_ms'), previous_startup.get('warm_ms'), tolerance)
+    check('warm start subprocesses', startup.get('subprocesses_warm'), previous_startup.get('subprocesses_warm'), 0.0)
+    return regressions
+
+def run_benchmark(args) -> bool:
+    if IS_WINDOWS:
+        print(f"{Colors.RED}The benchmark's stand-in executables need a POSIX shell{Colors.END}")
+        return False
+    
+    mean, _, sd = args.bench_throughput.partition(':')
+    throughput = (float(mean), float(sd) if sd else float(mean) * 0.2)
+    sizes = [int(size) for size in args.bench_sizes.split(',') if size.strip()]
+    
+    print(f"{Colors.BOLD}TBI Speed offline benchmark{Colors.END}")
+    print(f"Seed {args.bench_seed} | {args.bench_relays} relays | connect latency {args.bench_latency:g}s | "
+          f"failure rate {args.bench_failure_rate:.0%} | throughput {throughput[0]:g}±{throughput[1]:g} Mbps\n")
+    
+    report = {'config': {'seed': args.bench_seed, 'relays': args.bench_relays,
+                         'connect_latency': args.bench_latency, 'failure_rate': args.bench_failure_rate,
+                         'throughput': list(throughput)}}
+    
+    print(f"{Colors.CYAN}Sweeping simulated relays...{Colors.END}")
+    report['sweep'] = sweep = benchmark_sweep(args.bench_relays, args.bench_latency, args.bench_failure_rate,
+                                              throughput, args.bench_seed)
+    print(f"  Measured:               {sweep['measured']}/{sweep['relays']}")
+    print(f"  Wall time per relay:    {sweep['wall_per_relay']:.3f}s")
+    if sweep['connect_per_relay'] is not None:
+        print(f"  Connect time per relay: {sweep['connect_per_relay']:.3f}s")
+    print(f"  Subprocesses per relay: {sweep['subprocesses_per_relay']:.2f}")
+    print(f"  Fixed sleeps per relay: {sweep['fixed_sleep_per_relay']:.3f}s")
+    print("  Per relay by phase:")
+    for phase, seconds in sweep['phases'].items():
+        print(f"    {phase:<34} {seconds:.3f}s")
+    
+    print(f"\n{Colors.CYAN}Parsing synthetic relay lists...{Colors.END}")
+    report['parse'] = benchmark_parse(sizes, args.bench_seed)
+    print(f"  {'Relays':>8} {'Text':>12} {'relays.json':>12} {'Catalog':>12}")
+    for size, timings in report['parse'].items():
+        print(f"  {size:>8} {timings['parse_ms']:>9.2f} ms {timings['json_ms']:>9.2f} ms "
+              f"{timings['catalog_ms']:>9.2f} ms")
+    
+    print(f"\n{Colors.CYAN}Starting up against a cold and a warm cache...{Colors.END}")
+    report['startup'] = startup = benchmark_startup(args.bench_relays, args.bench_seed)
+    print(f"  Interpreter:            {startup['interpreter_ms']:.1f} ms")
+    print(f"  Module import:          {startup['import_ms']:.1f} ms")
+    print(f"  Cold start to --list:   {startup['cold_ms']:.1f} ms ({startup['subprocesses_cold']} subprocesses)")
+    print(f"  Warm start to --list:   {startup['warm_ms']:.1f} ms ({startup['subprocesses_warm']} subprocesses)")
+    
+    if args.bench_output:
+        write_json_atomic(os.path.abspath(args.bench_output), report)
+        print(f"\n{Colors.GREEN}✓ Saved to {args.bench_output}{Colors.END}")
+    
+    if not args.bench_baseline:
+        return True
+    
+    with open(args.bench_baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(report, baseline, args.bench_tolerance)
+    print()
+    if regressions:
+        print(f"{Colors.RED}✗ Regressed against {args.bench_baseline}:{Colors.END}")
+        for regression in regressions:
+            print(f"  {regression}")
+        return False
+    print(f"{Colors.GREEN}✓ Within {args.bench_tolerance:.0%} of {args.bench_baseline}{Colors.END}")
+    return True
+
+def default_history_path() -> str:
+    return os.path.join(get_cache_dir(), 'history.sqlite3')
+
+def history_query(args):
+    try:
+        store = HistoryStore(args.history or default_history_path())
+    except sqlite3.Error as e:
+        print(f"{Colors.RED}Cannot open history: {e}{Colors.END}")
+        sys.exit(1)
+    
+    try:
+        if args.query == 'trend':
+            if not args.server:
+                print(f"{Colors.RED}Error: --server required for the trend query{Colors.END}")
+                sys.exit(1)
+            rows = store.trend(args.server, args.days)
+            print(f"{Colors.BOLD}Daily medians for {args.server} (last {args.days:g} days){Colors.END}\n")
+            print(f"{'Day':<12} {'Samples':<8} {'Download':<15} {'Upload':<15} {'Ping':<10}")
+            print("-" * 62)
+            for row in rows:
+                print(f"{row['day']:<12} {row['n']:<8} {row['download']:>8.2f} Mbps  "
+                      f"{row['upload']:>8.2f} Mbps  {row['ping']:>6.2f} ms")
+        else:
+            rows = store.server_summaries(args.days, country=args.country, city=args.city,
+                                          protocol=args.provider, server=args.server)
+            if args.query == 'fastest':
+                rows = rows[:args.limit or 10]
+            title = 'Fastest relays' if args.query == 'fastest' else 'Download percentiles'
+            print(f"{Colors.BOLD}{title} (last {args.days:g} days){Colors.END}\n")
+            print(f"{'Server':<20} {'Location':<25} {'Protocol':<10} {'Samples':<8} "
+                  f"{'P10':>8} {'Median':>8} {'P90':>8} {'Stddev':>8}  {'Last seen':<16}")
+            print("-" * 120)
+            for row in rows:
+                stats = row['stats']
+                location = f"{row['city']}, {row['country'][:2].upper()}"
+                last_seen = datetime.fromtimestamp(row['last_seen']).strftime('%Y-%m-%d %H:%M')
+                print(f"{row['server']:<20} {location:<25} {row['protocol']:<10} {stats['n']:<8} "
+                      f"{stats['p10']:>8.2f} {stats['median']:>8.2f} {stats['p90']:>8.2f} {stats['stddev']:>8.2f}  {last_seen:<16}")
+        
+        if not rows:
+            print(f"{Colors.YELLOW}No measurements recorded in this window{Colors.END}")
+    finally:
+        store.close()
+
+class ResultColumns:
+    def __init__(self, label: str, by: str = 'server'):
+        self.label = label
+        self.by = by
+        self.keys = []
+        self.places = []
+        self.index = {}
+        self.groups = array('l')
+        self.columns = {metric: array('d') for metric in COMPARE_METRICS}
+        self.files = 0
+        self.results = 0
+    
+    def _group(self, server: str, country: str, city: str) -> int:
+        if self.by == 'server':
+            key = server
+        elif self.by == 'city':
+            key = f"{city}, {country}"
+        else:
+            key = country
+        group = self.index.get(key)
+        if group is None:
+            group = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.places.append((country, city if self.by != 'country' else ''))
+        return group
+    
+    def add_result(self, result: Dict):
+        group = self._group(result['server'], result.get('country', ''), result.get('city', ''))
+        samples = result.get('samples') or {}
+        count = max((len(series) for series in samples.values()), default=1)
+        missing = float('nan')
+        for i in range(count):
+            self.groups.append(group)
+            for metric, column in self.columns.items():
+                series = samples.get(metric)
+                if series is not None:
+                    value = series[i] if i < len(series) else None
+                else:
+                    value = result.get(metric) if i == 0 else None
+                column.append(missing if value is None else value)
+        self.results += 1
+    
+    def add_rows(self, rows):
+        missing = float('nan')
+        for server, country, city, download, upload, ping in rows:
+            self.groups.append(self._group(server, country, city))
+            for metric, column in self.columns.items():
+                column.append({'download': download, 'upload': upload, 'ping': ping}.get(metric, missing))
+            self.results += 1
+    
+    def add_file(self, path: str):
+        with open(path) as f:
+            if path.endswith(('.ndjson', '.jsonl')):
+                records = (json.loads(line) for line in f if line.strip())
+                records = (record.get('result') if 'type' in record else record for record in records)
+            else:
+                data = json.load(f)
+                records = data if isinstance(data, list) else [data]
+            for record in records:
+                if isinstance(record, dict) and record.get('server') and record.get('download') is not None:
+                    self.add_result(record)
+        self.files += 1
+    
+    def distributions(self, metric: str) -> List[List[float]]:
+        buckets = [[] for _ in self.keys]
+        for group, value in zip(self.groups, self.columns[metric]):
+            if value == value:
+                buckets[group].append(value)
+        return buckets
+    
+    def describe(self) -> Dict:
+        return {'label': self.label, 'files': self.files, 'results': self.results, 'groups': len(self.keys)}
+
+def load_result_set(spec: str, by: str = 'server', history_path: Optional[str] = None) -> ResultColumns:
+    columns = ResultColumns(spec, by)
+    if spec.startswith('history:'):
+        bounds = [float(days) for days in spec[len('history:'):].split(':')]
+        now = time.time()
+        since = now - bounds[0] * 86400
+        until = now - bounds[1] * 86400 if len(bounds) > 1 else now + 1
+        store = HistoryStore(history_path or default_history_path())
+        try:
+            columns.add_rows(store.window(since, until))
+        finally:
+            store.close()
+    else:
+        if os.path.isdir(spec):
+            paths = [os.path.join(spec, name) for name in os.listdir(spec)
+                     if name.endswith(('.json', '.ndjson', '.jsonl'))]
+        elif any(char in spec for char in '*?['):
+            paths = glob.glob(spec)
+        else:
+            paths = [spec]
+        for path in sorted(paths):
+            columns.add_file(path)
+    if not columns.results:
+        raise ValueError(f"no results in {spec}")
+    return columns
+
+def compare_result_sets(baseline: ResultColumns, current: ResultColumns, alpha: float = COMPARE_ALPHA) -> Dict:
+    entries = []
+    for metric in COMPARE_METRICS:
+        before = baseline.distributions(metric)
+        after = current.distributions(metric)
+        for key, group in current.index.items():
+            previous = baseline.index.get(key)
+            if previous is None or not before[previous] or not after[group]:
+                continue
+            old, new = before[previous], after[group]
+            u, p = mann_whitney(old, new)
+            delta = cliffs_delta(u, len(old), len(new))
+            old_median, new_median = median(old), median(new)
+            country, city = current.places[group]
+            entries.append({
+                'key': key, 'country': country, 'city': city, 'metric': metric,
+                'baseline': {'n': len(old), 'median': round(old_median, 2)},
+                'current': {'n': len(new), 'median': round(new_median, 2)},
+                'change_pct': round((new_median - old_median) / old_median * 100, 1) if old_median else None,
+                'u': u, 'p': p, 'q': None, 'cliffs_delta': round(delta, 3), 'magnitude': effect_magnitude(delta),
+                'verdict': 'insufficient' if min_mann_whitney_p(len(old), len(new)) > alpha else None,
+            })
+    
+    testable = [entry for entry in entries if entry['verdict'] is None]
+    for entry, q in zip(testable, benjamini_hochberg([entry['p'] for entry in testable])):
+        entry['q'] = round(q, 4)
+        better = entry['cliffs_delta'] > 0 if RANK_KEYS[entry['metric']] else entry['cliffs_delta'] < 0
+        if q < alpha and entry['magnitude'] != 'negligible':
+            entry['verdict'] = 'improvement' if better else 'regression'
+        else:
+            entry['verdict'] = 'unchanged'
+    for entry in entries:
+        entry['p'] = round(entry['p'], 4)
+    
+    order = {'regression': 0, 'improvement': 1, 'unchanged': 2, 'insufficient': 3}
+    entries.sort(key=lambda entry: (order[entry['verdict']], entry['q'] if entry['q'] is not None else 1.0))
+    counts = {verdict: sum(entry['verdict'] == verdict for entry in entries) for verdict in order}
+    return {
+        'baseline': baseline.describe(),
+        'current': current.describe(),
+        'regressions': counts['regression'],
+        'improvements': counts['improvement'],
+        'unchanged': counts['unchanged'],
+        'insufficient': counts['insufficient'],
+        'missing': [key for key in baseline.keys if key not in current.index],
+        'new': [key for key in current.keys if key not in baseline.index],
+        'entries': entries,
+    }
+
+def display_comparison(comparison: Dict):
+    baseline, current = comparison['baseline'], comparison['current']
+    print("=" * 120)
+    print(f"{Colors.BOLD}RESULT COMPARISON{Colors.END}")
+    print(f"Baseline: {baseline['label']} ({baseline['files']} files, {baseline['results']} results, {baseline['groups']} groups)")
+    print(f"Current:  {current['label']} ({current['files']} files, {current['results']} results, {current['groups']} groups)")
+    print("=" * 120)
+    
+    flagged = [entry for entry in comparison['entries'] if entry['verdict'] in ('regression', 'improvement')]
+    if flagged:
+        print(f"{'':<3}{'Group':<28} {'Metric':<12} {'Baseline':>10} {'Current':>10} {'Change':>9} "
+              f"{'n':>9} {'Cliff δ':>8} {'q':>8}  {'Verdict':<12}")
+        print("-" * 120)
+        for entry in flagged:
+            color, mark = (Colors.RED, '▼') if entry['verdict'] == 'regression' else (Colors.GREEN, '▲')
+            change = f"{entry['change_pct']:+.1f}%" if entry['change_pct'] is not None else '-'
+            counts = f"{entry['baseline']['n']}/{entry['current']['n']}"
+            print(f"{color}{mark:<3}{Colors.END}{entry['key'][:28]:<28} {entry['metric']:<12} "
+                  f"{entry['baseline']['median']:>10.2f} {entry['current']['median']:>10.2f} {change:>9} "
+                  f"{counts:>9} {entry['cliffs_delta']:>+8.2f} {entry['q']:>8.4f}  "
+                  f"{color}{entry['verdict']} ({entry['magnitude']}){Colors.END}")
+        print()
+    
+    print(f"{Colors.RED if comparison['regressions'] else Colors.GREEN}{comparison['regressions']} regressions{Colors.END}, "
+          f"{comparison['improvements']} improvements, {comparison['unchanged']} unchanged, "
+          f"{comparison['insufficient']} with too few samples to test")
+    for title, keys in (('Only in baseline', comparison['missing']), ('Only in current', comparison['new'])):
+        if keys:
+            more = f" (+{len(keys) - 10} more)" if len(keys) > 10 else ''
+            print(f"{title}: {', '.join(keys[:10])}{more}")
+    print()
+
+def compare_results(args) -> int:
+    if len(args.compare) < 2:
+        print(f"{Colors.RED}Error: --compare needs a baseline and at least one result set to compare{Colors.END}")
+        return 2
+    output = sys.stdout
+    if args.diff == '-':
+        sys.stdout = sys.stderr
+    
+    started = time.perf_counter()
+    try:
+        sets = [load_result_set(spec, args.compare_by, args.history) for spec in args.compare]
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"{Colors.RED}Cannot load results: {e}{Colors.END}")
+        return 2
+    print(f"{Colors.CYAN}Loaded {sum(s.results for s in sets)} results from {sum(s.files for s in sets)} files "
+          f"in {(time.perf_counter() - started) * 1000:.0f} ms{Colors.END}\n")
+    
+    comparisons = [compare_result_sets(sets[0], current, args.alpha) for current in sets[1:]]
+    for comparison in comparisons:
+        display_comparison(comparison)
+    
+    regressions = sum(comparison['regressions'] for comparison in comparisons)
+    if args.diff:
+        diff = {'version': 1, 'generated_at': datetime.now().isoformat(), 'by': args.compare_by,
+                'alpha': args.alpha, 'test': 'mann-whitney-u', 'correction': 'benjamini-hochberg',
+                'regressions': regressions, 'comparisons': comparisons}
+        if args.diff == '-':
+            json.dump(diff, output, indent=2)
+            output.write('\n')
+        else:
+            with open(args.diff, 'w') as f:
+                json.dump(diff, f, indent=2)
+            print(f"{Colors.GREEN}✓ Diff saved to {args.diff}{Colors.END}")
+    return 1 if regressions else 0
+
+def configure_tester(tester: MullvadSpeedTester, args):
+    tester.traffic_probe = parse_host_port(args.probe_host, TRAFFIC_PROBE[1])
+    tester.connect_timeout = args.connect_timeout
+    tester.cache_ttl = args.cache_ttl
+    tester.relay_data_path = args.relay_data
+    if args.echo_target:
+        tester.echo_target = parse_host_port(args.echo_target, ECHO_PORT)
+        tester.echo_protocol = args.echo_protocol
+        tester.echo_rate = args.echo_rate
+    tester.sort_by = args.sort_by or ['download']
+    tester.score = args.score
+    tester.pareto = args.pareto
+    tester.top = args.top
+    if args.stream:
+        output = sys.stdout
+        if args.stream_file == '-':
+            sys.stdout = sys.stderr
+        stream = ResultStream(args.stream, args.stream_file, output)
+        tester.result_listeners.append(stream.emit)
+        atexit.register(stream.close)
+    tester.samples = max(1, args.samples)
+    tester.max_samples = max(tester.samples, args.max_samples or (tester.samples * 2 if tester.samples > 1 else 1))
+    if not args.no_history:
+        try:
+            tester.history = HistoryStore(args.history or default_history_path())
+            tester.result_listeners.append(tester.history.record)
+        except sqlite3.Error as e:
+            print(f"{Colors.YELLOW}History disabled: {e}{Colors.END}")
+    
+    tester.backend_options = {'name': args.backend, 'target': args.target,
+                              'upload_url': args.upload_url, 'duration': args.test_duration, 'streams': args.streams}
+    try:
+        tester.backend = make_backend(args.backend, args.target, args.upload_url, args.test_duration, args.streams)
+    except ValueError as e:
+        print(f"{Colors.RED}Error: {e}{Colors.END}")
+        sys.exit(1)
+
+def interactive_mode(args):
     tester = MullvadSpeedTester()
+    configure_tester(tester, args)
     
     print(f"{Colors.BOLD}TBI Speed for Mullvad v3.0{Colors.END}")
     print(f"{Colors.CYAN}Created by TheBearInternal{Colors.END}")
@@ -721,10 +4583,11 @@ def interactive_mode():
     tester.check_requirements()
     
     print(f"\n{Colors.CYAN}Loading servers...{Colors.END}")
-    tester.get_all_relays()
+    tester.get_all_relays(force_refresh=args.refresh)
     print(f"{Colors.GREEN}✓ {len(tester.all_relays)} servers loaded{Colors.END}")
     
     tester.original_server = tester.get_connected_server()
+    tester.tunnel_connected = tester.original_server is not None
     if tester.original_server:
         print(f"{Colors.YELLOW}Current: {tester.original_server}{Colors.END}")
     
@@ -750,10 +4613,19 @@ def interactive_mode():
             
             if options.get('specific_servers'):
                 tester.test_servers(relays, specific_servers=options['specific_servers'])
+            elif options.get('prescreen'):
+                tester.test_servers(tester.screen_relays(relays, options['prescreen']))
+            elif options.get('time_budget'):
+                tester.budget = RunBudget(options['time_budget'], tester.backend.expected_seconds(args.test_duration))
+                tester.test_servers(tester.order_by_history(relays))
             else:
+                if options.get('limit'):
+                    relays = tester.order_by_history(relays)
                 tester.test_servers(relays, limit=options.get('limit'))
             
             tester.display_results()
+            if args.timings:
+                tester.display_timings()
             
             if options.get('output'):
                 tester.save_results(options['output'])
@@ -762,6 +4634,8 @@ def interactive_mode():
             print(f"\n{Colors.YELLOW}Test interrupted{Colors.END}")
         
         finally:
+            tester.budget = None
+            tester.priority = {}
             tester.restore_original_connection()
         
         another = input(f"\n{Colors.GREEN}Test another location? [y/N]: {Colors.END}").strip().lower()
@@ -771,8 +4645,17 @@ def interactive_mode():
     print(f"\n{Colors.YELLOW}Thanks for using TBI Speed for Mullvad!{Colors.END}")
     print(f"{Colors.CYAN}Created with ❤️ by TheBearInternal{Colors.END}\n")
 
+def default_journal_path(args) -> str:
+    selection = {'country': sorted(args.country or []), 'city': sorted(args.city or []),
+                 'region': sorted(args.region or []), 'provider': args.provider, 'limit': args.limit,
+                 'nearest': args.nearest, 'location': args.location, 'prescreen': args.prescreen,
+                 'screen_method': args.screen_method, 'time_budget': args.time_budget}
+    key = hashlib.sha1(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(get_cache_dir(), f"sweep-journal-{key}.ndjson")
+
 def command_line_mode(args):
     tester = MullvadSpeedTester()
+    configure_tester(tester, args)
     
     print(f"{Colors.BOLD}TBI Speed for Mullvad v3.0{Colors.END}")
     print("=" * 50)
@@ -780,10 +4663,9 @@ def command_line_mode(args):
     tester.check_requirements()
     print()
     
-    tester.original_server = tester.get_connected_server()
-    
     print(f"{Colors.CYAN}Loading servers...{Colors.END}")
-    relays = tester.filter_relays(country=args.country, city=args.city, provider=args.provider)
+    tester.get_all_relays(force_refresh=args.refresh)
+    relays = tester.select_relays(args.country, args.city, args.region, args.provider)
     
     if not relays:
         print(f"{Colors.RED}No servers found{Colors.END}")
@@ -798,25 +4680,84 @@ def command_line_mode(args):
             if location != current_location:
                 print(f"\n{Colors.BOLD}{location}{Colors.END}")
                 current_location = location
-            print(f"  {relay['server']:<20} ({relay['provider']})")
+            details = relay['provider']
+            if relay.get('hoster'):
+                details += f", {relay['hoster']} {'owned' if relay.get('owned') else 'rented'}"
+            print(f"  {relay['server']:<20} ({details})")
         sys.exit(0)
     
-    if not args.country:
-        print(f"{Colors.RED}Error: --country required for testing{Colors.END}")
+    journal = ResultJournal(args.journal or default_journal_path(args))
+    plan = None
+    if args.resume:
+        plan, previous = ResultJournal.load(journal.path)
+        if plan is None:
+            print(f"{Colors.YELLOW}No sweep to resume in {journal.path}, starting a new one{Colors.END}\n")
+        else:
+            cutoff = datetime.now() - timedelta(minutes=args.resume_window)
+            tester.results = [r for r in previous if datetime.fromisoformat(r['timestamp']) >= cutoff]
+            print(f"{Colors.GREEN}Resuming sweep: {len(tester.results)} of {len(plan)} relays measured "
+                  f"in the last {args.resume_window:g} minutes{Colors.END}\n")
+    
+    if plan is None and not (args.country or args.region or args.nearest):
+        print(f"{Colors.RED}Error: --country, --region or --nearest required for testing{Colors.END}")
         sys.exit(1)
     
+    tester.original_server = tester.get_connected_server()
+    tester.tunnel_connected = tester.original_server is not None
+    
     try:
-        tester.test_servers(relays, limit=args.limit)
+        if args.time_budget:
+            tester.budget = RunBudget(args.time_budget, tester.backend.expected_seconds(args.test_duration))
+        if plan is None and args.nearest:
+            location = tester.resolve_location(args.location)
+            if location is None:
+                print(f"{Colors.RED}Error: could not determine a location from {args.location!r}; "
+                      f"pass --location LAT,LON or a city name{Colors.END}")
+                return
+            print(f"{Colors.CYAN}Ranking relays by distance from {location[2]}{Colors.END}")
+            relays = tester.select_nearest(relays, args.nearest, location[0], location[1])
+        if plan is None and args.prescreen:
+            relays = tester.screen_relays(relays, args.prescreen, method=args.screen_method)
+        elif plan is None and (args.limit or args.time_budget) and not args.nearest:
+            relays = tester.order_by_history(relays)
+        if args.find_best:
+            candidates = relays[:args.limit] if args.limit else relays
+            tester.find_best(candidates, budget=args.find_best)
+        else:
+            if plan is None:
+                plan = relays[:args.limit] if args.limit else relays
+            journal.start(plan, tester.results)
+            tester.result_listeners.append(journal.append)
+            done = {r['server'] for r in tester.results}
+            remaining = [relay for relay in plan if relay['server'] not in done]
+            
+            if not remaining:
+                print(f"{Colors.GREEN}Every relay in the plan is already measured{Colors.END}\n")
+            elif args.parallel:
+                tester.test_servers_parallel(remaining, concurrency=args.parallel,
+                                             bandwidth_mbit=args.parallel_bandwidth,
+                                             device=load_device_wireguard_config(args.device_file) if args.device_file else None,
+                                             peers=load_relay_wireguard_peers(args.relay_data) if args.relay_data else None)
+            else:
+                tester.test_servers(remaining)
         tester.display_results()
+        if args.timings:
+            tester.display_timings()
         
         if args.output:
             tester.save_results(args.output)
     
     except KeyboardInterrupt:
         print(f"\n{Colors.YELLOW}Interrupted{Colors.END}")
+        if not args.find_best:
+            print("Measured relays are journaled; rerun the same command with --resume to continue")
     
     finally:
+        journal.close()
         tester.restore_original_connection()
+        if args.trace:
+            TRACER.save(args.trace)
+            print(f"{Colors.GREEN}✓ Trace saved to {args.trace}{Colors.END}")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -829,26 +4770,187 @@ https://github.com/TheBearInternal/tbi-speed-mullvad
         """
     )
     
-    parser.add_argument('--country', type=str, help='Country to test')
-    parser.add_argument('--city', type=str, help='City to test')
+    parser.add_argument('--country', action='append', help='Country to test (repeat for several)')
+    parser.add_argument('--city', action='append', help='City to test (repeat for several)')
+    parser.add_argument('--region', action='append', choices=sorted(REGIONS),
+                       help='Test every country in a region (repeat for several)')
     parser.add_argument('--provider', type=str, choices=['wireguard', 'openvpn'], 
                        help='Protocol filter')
     parser.add_argument('--limit', type=int, help='Limit servers to test')
     parser.add_argument('--output', type=str, help='Save results to JSON')
+    parser.add_argument('--timings', action='store_true',
+                       help='Print a per-phase timing summary after the results')
+    parser.add_argument('--trace', metavar='FILE',
+                       help='Export phase timings as a Chrome/Perfetto trace JSON')
+    parser.add_argument('--history', metavar='PATH',
+                       help='SQLite database every measurement is recorded in (default: in the cache directory)')
+    parser.add_argument('--no-history', action='store_true',
+                       help='Do not record measurements or order relays by past results')
+    parser.add_argument('--query', choices=['fastest', 'trend', 'summary'],
+                       help='Query the history: fastest relays, a server\'s daily trend, or percentile summaries')
+    parser.add_argument('--days', type=float, default=HISTORY_DAYS,
+                       help=f'History window in days for --query (default {HISTORY_DAYS})')
+    parser.add_argument('--server', help='Server hostname for --query trend/summary')
+    parser.add_argument('--compare', nargs='+', metavar='SET',
+                       help='Compare result sets against the first: JSON files, quoted globs, directories or '
+                            'history:FROM[:TO] (days ago). Exits 1 on significant regressions')
+    parser.add_argument('--compare-by', choices=['server', 'city', 'country'], default='server',
+                       help='Align compared results by relay, city or country (default server)')
+    parser.add_argument('--alpha', type=float, default=COMPARE_ALPHA,
+                       help=f'False discovery rate for --compare (default {COMPARE_ALPHA})')
+    parser.add_argument('--diff', metavar='FILE',
+                       help='Write the --compare diff as JSON; "-" is stdout, with the report moved to stderr')
+    parser.add_argument('--stream', type=str, choices=['ndjson', 'csv'],
+                       help='Emit each result as NDJSON or CSV the moment it is measured')
+    parser.add_argument('--stream-file', type=str, default='-', metavar='PATH',
+                       help='Where --stream writes; "-" is stdout, with all other output moved to stderr (default -)')
+    parser.add_argument('--journal', metavar='PATH',
+                       help='Append each result to this NDJSON journal as it is measured '
+                            '(default: one per relay selection in the cache directory)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Continue the sweep recorded in the journal, skipping relays measured recently; '
+                            'repeat the selection options or pass the same --journal')
+    parser.add_argument('--resume-window', type=float, default=DEFAULT_RESUME_WINDOW, metavar='MINUTES',
+                       help=f'Journaled results younger than this are kept on --resume (default {DEFAULT_RESUME_WINDOW})')
+    parser.add_argument('--samples', type=int, default=1, metavar='N',
+                       help='Measurements per relay; results rank on the median (default 1)')
+    parser.add_argument('--max-samples', type=int, metavar='N',
+                       help='Take extra samples up to N while a relay\'s download varies by more than 15%%; with '
+                            '--samples 1 a second sample is always taken to judge that (default 2x --samples, '
+                            'or no extra samples with --samples 1)')
+    parser.add_argument('--find-best', type=float, nargs='?', const=300.0, metavar='SECONDS',
+                       help='Successive-halving search for the fastest relay within a time budget (default 300s)')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                       help='Test as many relays and samples as fit in SECONDS, re-planned from observed timings')
+    parser.add_argument('--nearest', type=int, metavar='N',
+                       help='Test the N relays physically closest to --location, worldwide or within --country/--region')
+    parser.add_argument('--location', type=str, default='auto', metavar='WHERE',
+                       help='Client location for --nearest: LAT,LON, a city name, or auto to estimate it (default auto)')
+    parser.add_argument('--prescreen', type=int, metavar='K',
+                       help='Probe relay latency without connecting and test only the K closest')
+    parser.add_argument('--screen-method', type=str, choices=['tcp', 'udp', 'icmp'], default='tcp',
+                       help=f'Probe used by --prescreen; udp counts an echo or a port-unreachable on port {ECHO_PORT}')
     parser.add_argument('--list', action='store_true', help='List servers and exit')
+    parser.add_argument('--probe-host', type=str, default=f"{TRAFFIC_PROBE[0]}:{TRAFFIC_PROBE[1]}",
+                       help='Host:port used to confirm the tunnel carries traffic')
+    parser.add_argument('--connect-timeout', type=float, default=20.0,
+                       help='Seconds to wait for a tunnel to become ready')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                       help='Seconds before the cached relay list is refreshed in the background')
+    parser.add_argument('--refresh', action='store_true', help='Reload the relay list from the daemon now')
+    parser.add_argument('--backend', type=str, choices=BACKENDS, default='speedtest',
+                       help='Throughput measurement backend')
+    parser.add_argument('--target', type=str,
+                       help='Pinned measurement target: speedtest server id, HTTP download URL(s, comma-separated) or iperf3 host[:port]')
+    parser.add_argument('--upload-url', type=str, help='HTTP upload URL (default: derived from --target)')
+    parser.add_argument('--streams', type=int, default=1, metavar='N',
+                       help='Parallel streams per direction for the http and iperf3 backends (default 1)')
+    parser.add_argument('--test-duration', type=float, default=10.0,
+                       help='Seconds per direction for the http and iperf3 backends')
+    parser.add_argument('--serve-reference', type=int, metavar='PORT',
+                       help='Run a reference HTTP server for the http backend and exit on Ctrl-C')
+    parser.add_argument('--serve-echo', type=int, metavar='PORT',
+                       help='Run a UDP and TCP echo server for --echo-target and exit on Ctrl-C')
+    parser.add_argument('--echo-target', type=str, metavar='HOST[:PORT]',
+                       help=f'Echo endpoint probed for latency before and during the throughput test (default port {ECHO_PORT})')
+    parser.add_argument('--echo-protocol', type=str, choices=['udp', 'tcp'], default='udp',
+                       help='Echo probe transport (default udp)')
+    parser.add_argument('--echo-rate', type=float, default=ECHO_RATE, metavar='HZ',
+                       help=f'Echo probes sent per second (default {ECHO_RATE:g})')
+    parser.add_argument('--sort-by', type=parse_sort_keys, metavar='KEY[,KEY...]',
+                       help=f"Rank on these keys in order, each in its natural direction ({', '.join(RANK_KEYS)}; "
+                            f"default download)")
+    parser.add_argument('--score', type=parse_score, metavar='METRIC:WEIGHT,...',
+                       help=f"Rank on a weighted composite of min-max normalized metrics, or a preset "
+                            f"({', '.join(SCORE_PRESETS)})")
+    parser.add_argument('--pareto', action='store_true',
+                       help='Mark and list relays no other relay beats on every ranked metric')
+    parser.add_argument('--top', type=int, metavar='K', help='Show only the K best-ranked relays')
+    parser.add_argument('--parallel', type=int, metavar='N',
+                       help='Linux only: test N WireGuard relays at once, each in its own network namespace')
+    parser.add_argument('--parallel-bandwidth', type=float, metavar='MBPS',
+                       help='Link capacity shared fairly between parallel tunnels')
+    parser.add_argument('--device-file', type=str, help='Mullvad device.json with the WireGuard key')
+    parser.add_argument('--relay-data', type=str, help="Mullvad relays.json to load relays and WireGuard keys from, read on every run instead of "
+                            "the relay cache (default: the daemon's cache)")
+    parser.add_argument('--netns-selftest', action='store_true',
+                       help='Verify parallel testing against local namespace relays and exit')
+    parser.add_argument('--measure-worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--daemon', action='store_true',
+                       help='Keep running, testing the selected relays in rotation and serving OpenMetrics')
+    parser.add_argument('--interval', type=float, default=900.0, metavar='SECONDS',
+                       help='Seconds between monitoring cycles (default 900)')
+    parser.add_argument('--jitter', type=float, default=0.1, metavar='FRACTION',
+                       help='Random spread applied to --interval (default 0.1)')
+    parser.add_argument('--daemon-batch', type=int, default=1, metavar='N',
+                       help='Relays tested per monitoring cycle (default 1)')
+    parser.add_argument('--max-tunnel-share', type=float, default=0.25, metavar='FRACTION',
+                       help='Longest fraction of wall time a test tunnel may be up (default 0.25)')
+    parser.add_argument('--metrics-port', type=int, default=9638, help='OpenMetrics port (default 9638)')
+    parser.add_argument('--metrics-bind', default='127.0.0.1', help='OpenMetrics bind address (default 127.0.0.1)')
+    parser.add_argument('--benchmark', action='store_true',
+                       help='Benchmark orchestration overhead offline against simulated mullvad/speedtest-cli')
+    parser.add_argument('--bench-relays', type=int, default=20, metavar='N',
+                       help='Simulated relays swept by --benchmark (default 20)')
+    parser.add_argument('--bench-latency', type=float, default=0.2, metavar='SECONDS',
+                       help='Mean simulated connect latency (default 0.2)')
+    parser.add_argument('--bench-failure-rate', type=float, default=0.0, metavar='RATE',
+                       help='Fraction of simulated connection attempts that never come up (default 0)')
+    parser.add_argument('--bench-throughput', default='300:60', metavar='MEAN[:SD]',
+                       help='Simulated download distribution in Mbit/s (default 300:60)')
+    parser.add_argument('--bench-seed', type=int, default=1, help='Seed for the simulation (default 1)')
+    parser.add_argument('--bench-sizes', default='1000,10000,100000', metavar='N,N,...',
+                       help='Synthetic relay list sizes to time parsing on')
+    parser.add_argument('--bench-output', metavar='FILE', help='Save the benchmark report as JSON')
+    parser.add_argument('--bench-baseline', metavar='FILE',
+                       help='Fail when the report regresses against this saved report')
+    parser.add_argument('--bench-tolerance', type=float, default=0.25, metavar='FRACTION',
+                       help='Allowed slowdown against --bench-baseline (default 0.25)')
     parser.add_argument('--no-splash', action='store_true', help='Skip splash screen')
     parser.add_argument('--version', action='version', 
                        version='%(prog)s 3.0 - TheBearInternal')
     
     args = parser.parse_args()
+    if args.score and args.sort_by:
+        parser.error('--score and --sort-by are mutually exclusive: a score ranks on its own weighted metrics')
+    
+    if args.serve_reference:
+        serve_reference(args.serve_reference)
+        return
+    
+    if args.serve_echo:
+        serve_echo(args.serve_echo)
+        return
+    
+    if args.measure_worker:
+        measure_worker(args)
+        return
+    
+    if args.netns_selftest:
+        sys.exit(0 if netns_selftest() else 1)
+    
+    if args.compare:
+        sys.exit(compare_results(args))
+    
+    if args.query:
+        history_query(args)
+        return
+    
+    if args.benchmark:
+        sys.exit(0 if run_benchmark(args) else 1)
+    
+    if args.daemon:
+        run_daemon(args)
+        return
     
-    if not args.no_splash and not any([args.country, args.list, args.output]):
+    if not args.no_splash and not any([args.country, args.region, args.list, args.output, args.resume, args.stream,
+                                       args.nearest]):
         show_splash_screen()
     
-    if args.country or args.list:
+    if args.country or args.region or args.list or args.resume or args.nearest:
         command_line_mode(args)
     else:
-        interactive_mode()
+        interactive_mode(args)
 
 if __name__ == '__main__':
     main()